@@ -1,95 +1,224 @@
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, jsonify, redirect, request, render_template, stream_with_context
 from flask_cors import CORS
 import sqlite3
-import bcrypt
 from datetime import datetime
 import uuid
 import re
+import atexit
+import io
+import itertools
 import json
+import os
 import time
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from auth import InvalidSession, PasswordPool, PasswordPoolBusy, SessionTokens
+from availability import AvailabilityCache, ChangeLog
+from db_pool import ConnectionPool
+from ingest import ingest, iter_csv, iter_ndjson
+from metrics import STARTED_KEY, Histogram, Metrics
+from recorder import RequestRecorder
+from settlement import create_tables as create_settlement_tables, fare
+from spatial import (CANDIDATES_SQL, CREATE_INDEX_SQL, INDEX_BICYCLE_SQL, REBUILD_INDEX_SQL,
+                     UNINDEX_BICYCLE_SQL, nearest_bicycles, valid_coordinates)
+from stream_server import StreamServer
+from writer import WriteQueue, WriteUnavailable
 
 app = Flask(__name__)
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or os.urandom(32).hex()
 CORS(app)
 
-# Database connection function with timeout
+DATABASE = os.environ.get('BICYCLE_DB', 'bicycleRental.db')
+
+# Run as `python app.py`, this script is re-imported as __mp_main__ by each
+# bcrypt worker (see auth.PasswordPool). Workers only need its functions, so
+# the setup that opens the database, starts threads or opens files is
+# skipped there.
+SERVING = __name__ != '__mp_main__'
+
+# One page of the /bicycles listing, keyset-paginated on BicycleID
+AVAILABLE_BICYCLES_QUERY = '''
+    SELECT B.BicycleID, B.Status, B.Location, B.Gear, B.Latitude, B.Longitude, U.Name AS OwnerName
+    FROM Bicycle B
+    LEFT JOIN Users U ON B.UserID = U.UserID
+    WHERE B.Status = 'Available' AND B.BicycleID > ?
+    ORDER BY B.BicycleID
+    LIMIT ?
+'''
+
+# Reads on the hot routes (login, /give_rent, /bicycles, /bicycles/nearby,
+# /calculate_rent); prepared up front on each pooled connection
+WARM_STATEMENTS = [
+    ('SELECT * FROM Users WHERE EmailID = ?', ('',)),
+    ('SELECT 1 FROM Users WHERE UserID = ?', ('',)),
+    (AVAILABLE_BICYCLES_QUERY, ('', 0)),
+    (CANDIDATES_SQL, (0.0, 0.0, 0.0, 0.0)),
+    ('SELECT Gear FROM Bicycle WHERE BicycleID = ?', ('',)),
+    ('SELECT StartTime FROM Rents WHERE BicycleID = ? AND UserID = ? AND EndTime IS NULL', ('', '')),
+]
+
+db_pool = ConnectionPool(DATABASE, size=int(os.environ.get('DB_POOL_SIZE', 8)),
+                         warm_statements=WARM_STATEMENTS)
+
+# Route, query and stage timings for /metrics. METRICS=0 turns recording off;
+# METRICS_QUERY_SAMPLE is the fraction of connection checkouts whose queries
+# are timed; SLOW_QUERY_MS logs sampled queries slower than that (a
+# SLOW_QUERY_SAMPLE fraction of them) with their query plan.
+metrics = Metrics(enabled=os.environ.get('METRICS', '1') != '0',
+                  query_sample=float(os.environ.get('METRICS_QUERY_SAMPLE', 0.1)),
+                  slow_query_seconds=float(os.environ['SLOW_QUERY_MS']) / 1000 if os.environ.get('SLOW_QUERY_MS') else None,
+                  slow_query_sample=float(os.environ.get('SLOW_QUERY_SAMPLE', 1.0)))
+
+# Borrow a pooled connection: `with get_db_connection() as conn:`
+@contextmanager
 def get_db_connection():
-    conn = sqlite3.connect('bicycleRental.db', timeout=10.0)  # 10 seconds timeout for SQLite
-    conn.row_factory = sqlite3.Row
-    conn.execute('PRAGMA foreign_keys = ON')
-    return conn
-
-# Retry mechanism for database operations
-def execute_with_retry(conn, query, params=(), retries=3, delay=1):
-    for attempt in range(retries):
+    with db_pool.connection() as conn:
+        traced = metrics.connection(conn)
         try:
-            conn.execute(query, params)
-            conn.commit()
-            return
-        except sqlite3.OperationalError as e:
-            if 'database is locked' in str(e) and attempt < retries - 1:
-                time.sleep(delay)
-                continue
-            else:
-                raise
+            yield traced
+        finally:
+            if traced is not conn:
+                traced.finish()
+
+# All writes go through one writer thread that group-commits queued jobs
+WRITE_TIMEOUT = float(os.environ.get('WRITE_TIMEOUT', 5.0))
+writer = WriteQueue(DATABASE) if SERVING else None
+if writer is not None:
+    atexit.register(writer.close)
+
+# Run a write (SQL string or callable taking the connection) and wait for its
+# commit; on_commit(result) runs on the writer thread, in commit order
+def execute_write(job, params=(), on_commit=None):
+    with metrics.stage('write'):
+        return writer.execute(job, params, timeout=WRITE_TIMEOUT, on_commit=on_commit)
+
+# bcrypt runs on a bounded process pool; logins return a signed session token
+password_pool = PasswordPool(workers=int(os.environ.get('PASSWORD_WORKERS', 0)) or None)
+session_tokens = SessionTokens(app.config['SECRET_KEY'])
+atexit.register(password_pool.shutdown)
+
+# User ID from a "Bearer" session token, or None when the request carries none
+def session_user_id():
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    user_id = session_tokens.verify(header[len('Bearer '):])
+    if user_id is None:
+        raise InvalidSession()
+    return user_id
+
+# Per-route latency: stamped on the way in, recorded under the matched rule
+app.wsgi_app = metrics.wsgi_middleware(app.wsgi_app)
+
+@app.after_request
+def record_request_time(response):
+    # One context lookup; each costs about as much as the recording itself
+    metrics.observe_response(request._get_current_object(), response)
+    return response
+
+# Opt-in traffic capture for benchmarks/bench_replay.py: RECORD_REQUESTS=<file>
+# appends sanitized JSON lines for the main API routes.
+recorder = RequestRecorder(os.environ['RECORD_REQUESTS']) if SERVING and os.environ.get('RECORD_REQUESTS') else None
+if recorder is not None:
+    atexit.register(recorder.close)
+
+    @app.after_request
+    def record_request(response):
+        req = request._get_current_object()
+        recorder.record(req, response, time.perf_counter() - req.environ[STARTED_KEY])
+        return response
+
+@app.errorhandler(WriteUnavailable)
+@app.errorhandler(PasswordPoolBusy)
+def server_busy(e):
+    response = jsonify({"error": "Server is busy, please retry."})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.errorhandler(InvalidSession)
+def invalid_session(e):
+    return jsonify({"error": "Invalid or expired session, please log in again."}), 401
 
 # Create tables if they don't exist
 def create_tables():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS Users (
-            UserID VARCHAR(50) PRIMARY KEY,
-            Name VARCHAR(100) NOT NULL,
-            EmailID VARCHAR(100) UNIQUE NOT NULL,
-            PhoneNo VARCHAR(20),
-            DOB DATE,
-            Password VARCHAR(255) NOT NULL,
-            CONSTRAINT valid_email CHECK(EmailID LIKE '%_@__%.__%')
-        );
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS Bicycle (
-            BicycleID VARCHAR(50) PRIMARY KEY,
-            Status VARCHAR(20) NOT NULL CHECK (Status IN ('Available', 'Rented')),
-            Location VARCHAR(100),
-            Gear JSON,
-            UserID VARCHAR(50),
-            FOREIGN KEY (UserID) REFERENCES Users(UserID) ON DELETE SET NULL
-        );
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS Rents (
-            RentalID VARCHAR(50) PRIMARY KEY,
-            UserID VARCHAR(50),
-            BicycleID VARCHAR(50),
-            StartTime DATETIME NOT NULL,
-            EndTime DATETIME,
-            FOREIGN KEY (UserID) REFERENCES Users(UserID),
-            FOREIGN KEY (BicycleID) REFERENCES Bicycle(BicycleID)
-        );
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS Payments (
-            PaymentID VARCHAR(50) PRIMARY KEY,
-            UserID VARCHAR(50),
-            RentalID VARCHAR(50),
-            Amount DECIMAL(10, 2) NOT NULL,
-            PaymentDate DATETIME NOT NULL,
-            CardNumber VARCHAR(16),
-            FOREIGN KEY (UserID) REFERENCES Users(UserID),
-            FOREIGN KEY (RentalID) REFERENCES Rents(RentalID)
-        );
-    ''')
-
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS Users (
+                UserID VARCHAR(50) PRIMARY KEY,
+                Name VARCHAR(100) NOT NULL,
+                EmailID VARCHAR(100) UNIQUE NOT NULL,
+                PhoneNo VARCHAR(20),
+                DOB DATE,
+                Password VARCHAR(255) NOT NULL,
+                CONSTRAINT valid_email CHECK(EmailID LIKE '%_@__%.__%')
+            );
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS Bicycle (
+                BicycleID VARCHAR(50) PRIMARY KEY,
+                Status VARCHAR(20) NOT NULL CHECK (Status IN ('Available', 'Rented')),
+                Location VARCHAR(100),
+                Gear JSON,
+                UserID VARCHAR(50),
+                Latitude REAL,
+                Longitude REAL,
+                FOREIGN KEY (UserID) REFERENCES Users(UserID) ON DELETE SET NULL
+            );
+        ''')
+
+        # Databases created before bikes carried coordinates
+        columns = {row['name'] for row in cursor.execute('PRAGMA table_info(Bicycle)')}
+        for column in ('Latitude', 'Longitude'):
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE Bicycle ADD COLUMN {column} REAL')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS Rents (
+                RentalID VARCHAR(50) PRIMARY KEY,
+                UserID VARCHAR(50),
+                BicycleID VARCHAR(50),
+                StartTime DATETIME NOT NULL,
+                EndTime DATETIME,
+                FOREIGN KEY (UserID) REFERENCES Users(UserID),
+                FOREIGN KEY (BicycleID) REFERENCES Bicycle(BicycleID)
+            );
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS Payments (
+                PaymentID VARCHAR(50) PRIMARY KEY,
+                UserID VARCHAR(50),
+                RentalID VARCHAR(50),
+                Amount DECIMAL(10, 2) NOT NULL,
+                PaymentDate DATETIME NOT NULL,
+                CardNumber VARCHAR(16),
+                FOREIGN KEY (UserID) REFERENCES Users(UserID),
+                FOREIGN KEY (RentalID) REFERENCES Rents(RentalID)
+            );
+        ''')
+
+        # Keyset pagination over available bikes
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_bicycle_status ON Bicycle (Status, BicycleID)')
+
+        # Spatial index of available bikes for /bicycles/nearby
+        has_location_index = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'BicycleLocation'").fetchone()
+        cursor.execute(CREATE_INDEX_SQL)
+        if not has_location_index:
+            cursor.execute(REBUILD_INDEX_SQL)
+
+        # Finding a bike's open rental on return
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rents_open ON Rents (BicycleID) WHERE EndTime IS NULL')
+
+        create_settlement_tables(conn)
 
 # Run table creation on app start
-create_tables()
+if SERVING:
+    create_tables()
 
 # Serve the login page
 @app.route('/')
@@ -144,21 +273,17 @@ def register():
         return jsonify({"error": "Password does not meet the required criteria!"}), 400
 
     # Hash the password
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-
-    conn = get_db_connection()
+    with metrics.stage('password_hash'):
+        hashed_password = password_pool.hash(password)
 
     try:
-        conn.execute(
+        execute_write(
             'INSERT INTO Users (UserID, Name, EmailID, PhoneNo, Password, DOB) VALUES (?, ?, ?, ?, ?, ?)',
             (str(uuid.uuid4()), name, emailID, phoneNo, hashed_password, DOB)
         )
-        conn.commit()
         return jsonify({"message": "User registered successfully!"}), 201
     except sqlite3.IntegrityError:
         return jsonify({"error": "Email already exists!"}), 400
-    finally:
-        conn.close()
 
 def is_valid_password(password):
     if len(password) < 6:
@@ -184,113 +309,493 @@ def login_user():
     emailID = data['emailID']
     password = data['password']
 
-    conn = get_db_connection()
     try:
-        user = conn.execute('SELECT * FROM Users WHERE EmailID = ?', (emailID,)).fetchone()
+        with get_db_connection() as conn:
+            user = conn.execute('SELECT * FROM Users WHERE EmailID = ?', (emailID,)).fetchone()
+
+        valid = False
+        if user:
+            with metrics.stage('password_check'):
+                valid = password_pool.check(password, user['Password'])
 
-        if user and bcrypt.checkpw(password.encode('utf-8'), user['Password']):
-            response = {"message": "Login successful!", "userID": user['UserID']}
+        if valid:
+            response = {"message": "Login successful!", "userID": user['UserID'],
+                        "token": session_tokens.issue(user['UserID'])}
             return jsonify(response), 200
         else:
             return jsonify({"error": "Invalid email or password!"}), 401
+    except PasswordPoolBusy:
+        raise
     except Exception as e:
         return jsonify({"error": "Login failed due to an internal error."}), 500
-    finally:
-        conn.close()
 
-# API to get available bikes (for renting)
+# Rendered /bicycles pages, invalidated whenever a bike's availability changes
+availability = AvailabilityCache()
+
+# Log of availability deltas for /bicycles/stream. Its sequence number is
+# also the cache version, so a listing and the stream agree on a position.
+changes = ChangeLog()
+
+SSE_HEARTBEAT = 15.0
+
+# SSE_PORT=<port> serves /bicycles/stream from a StreamServer on that port:
+# one asyncio thread for every subscriber instead of a request thread each.
+# It starts with the first stream request; the route then only redirects.
+stream_server = StreamServer(changes, host=os.environ.get('SSE_HOST', '127.0.0.1'),
+                             port=int(os.environ['SSE_PORT']),
+                             heartbeat=SSE_HEARTBEAT) if os.environ.get('SSE_PORT') else None
+if stream_server is not None:
+    atexit.register(stream_server.close)
+
+# Record bikes being added, reserved or returned. Called from the writer's
+# on_commit, so events are published in the order the changes committed.
+def publish_availability(kind, bikes):
+    availability.bump(changes.publish(kind, bikes))
+
+def available_bike(bike_id, location, gear, latitude, longitude):
+    return {"BicycleID": bike_id, "Status": "Available", "Location": location, "Gear": gear,
+            "Latitude": latitude, "Longitude": longitude}
+
+# Pages are always built whole and cached, so each can carry its next-page
+# Link; only the unpaginated full listing is bigger than that and streamed.
+MAX_PAGE_SIZE = 500
+CACHED_ROWS = MAX_PAGE_SIZE
+STREAM_BATCH = 1000
+MAX_NEARBY_RADIUS = 50000.0
+MAX_NEARBY_LIMIT = 100
+
+# Yields the first CACHED_ROWS + 1 rows, then the rest in STREAM_BATCH chunks
+def query_available_bicycles(after, limit):
+    with get_db_connection() as conn:
+        cursor = conn.execute(AVAILABLE_BICYCLES_QUERY, (after, limit or -1))
+        yield cursor.fetchmany(CACHED_ROWS + 1)
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH)
+            if not rows:
+                return
+            yield rows
+
+def stream_json_array(batches):
+    yield '['
+    separator = ''
+    for rows in batches:
+        if rows:
+            with metrics.stage('json_encode'):
+                chunk = separator + ','.join(json.dumps(dict(row)) for row in rows)
+            yield chunk
+            separator = ','
+    yield ']'
+
+# API to get available bikes (for renting), optionally a page at a time:
+# /bicycles?after=<BicycleID>&limit=<n>, with a Link header to the next page
 @app.route('/bicycles', methods=['GET'])
 def get_bicycles():
-    conn = get_db_connection()
-    
-    query = '''
-    SELECT B.BicycleID, B.Status, B.Location, B.Gear, U.Name AS OwnerName
-    FROM Bicycle B
-    LEFT JOIN Users U ON B.UserID = U.UserID
-    WHERE B.Status = "Available"
-    '''
-    bicycles = conn.execute(query).fetchall()
-    conn.close()
-    return jsonify([dict(bicycle) for bicycle in bicycles])
+    after = request.args.get('after', '')
+    limit = request.args.get('limit', type=int)
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+
+    version = availability.version
+    etag = availability.etag(version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        page = availability.get(version, (after, limit))
+        if page is None:
+            batches = query_available_bicycles(after, limit)
+            head = next(batches)
+            if len(head) > CACHED_ROWS:
+                response = Response(stream_json_array(itertools.chain([head], batches)),
+                                    mimetype='application/json')
+            else:
+                batches.close()
+                next_after = head[-1]['BicycleID'] if limit and len(head) == limit else None
+                with metrics.stage('json_encode'):
+                    page = (json.dumps([dict(row) for row in head]), next_after)
+                availability.put(version, (after, limit), page)
+        if page is not None:
+            body, next_after = page
+            response = Response(body, mimetype='application/json')
+            if next_after:
+                response.headers['Link'] = f'</bicycles?after={next_after}&limit={limit}>; rel="next"'
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Where /bicycles/stream should pick up to follow changes from this listing
+    response.headers['X-Last-Event-ID'] = changes.event_id(version)
+    return response
+
+# Server-Sent Events feed of availability deltas ("added", "reserved",
+# "returned"; data is a JSON array of bikes). Resume with the Last-Event-ID
+# header, or ?lastEventId= taken from a /bicycles response. A "reset" event
+# means the position is unknown or too old and the client should reload
+# /bicycles. Served here, each open stream holds a server thread; with
+# SSE_PORT set, clients are redirected to the StreamServer instead.
+@app.route('/bicycles/stream', methods=['GET'])
+def stream_bicycles():
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    if stream_server is not None:
+        host = re.sub(r':\d+$', '', request.host)
+        query = urlencode({'lastEventId': last_event_id or ''})
+        return redirect(f'http://{host}:{stream_server.start()}/bicycles/stream?{query}', code=307)
+    start = changes.parse_event_id(last_event_id)
+
+    def generate():
+        with changes.subscription():
+            yield 'retry: 3000\n\n'
+            seq = start
+            while True:
+                seq, text = changes.read(seq)
+                if text:
+                    yield text
+                elif not changes.wait(seq, SSE_HEARTBEAT):
+                    yield ': keep-alive\n\n'
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# API to find the available bikes closest to a point:
+# /bicycles/nearby?lat=<deg>&lon=<deg>&radius=<meters>&limit=<n>
+@app.route('/bicycles/nearby', methods=['GET'])
+def get_nearby_bicycles():
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    radius = request.args.get('radius', 1000.0, type=float)
+    limit = request.args.get('limit', 10, type=int)
+
+    if lat is None or lon is None or not valid_coordinates(lat, lon):
+        return jsonify({"error": "Valid lat and lon are required"}), 400
+    if not 0 < radius <= MAX_NEARBY_RADIUS:
+        return jsonify({"error": f"radius must be between 0 and {MAX_NEARBY_RADIUS:.0f} meters"}), 400
+    if not 1 <= limit <= MAX_NEARBY_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {MAX_NEARBY_LIMIT}"}), 400
+
+    with get_db_connection() as conn:
+        bicycles = nearest_bicycles(conn, lat, lon, radius, limit)
+    return jsonify(bicycles)
 
 # API to give a bicycle for rent (user uploads their own bike)
 @app.route('/give_rent', methods=['POST'])
 def give_rent():
     data = request.get_json()
 
-    # Retrieve the data from the request body
-    user_id = data.get('userID')
+    # Retrieve the data from the request body; a session token vouches for the user
+    token_user_id = session_user_id()
+    user_id = token_user_id or data.get('userID')
     location = data.get('location')
     gear = data.get('gear')
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
 
     # Validate required fields
     if not user_id or not location or not gear:
         return jsonify({"error": "Missing required data"}), 400
 
+    # Coordinates are optional, but must come as a valid pair
+    if (latitude is not None or longitude is not None) and not valid_coordinates(latitude, longitude):
+        return jsonify({"error": "Invalid latitude/longitude"}), 400
+
     # Check if the user exists in the Users table
-    conn = get_db_connection()
-    try:
-        user_check = conn.execute('SELECT 1 FROM Users WHERE UserID = ?', (user_id,)).fetchone()
-        if not user_check:
-            return jsonify({"error": "UserID does not exist in the database!"}), 400
-    except Exception as e:
-        conn.close()
-        return jsonify({"error": f"Database error: {str(e)}"}), 500
+    if not token_user_id:
+        try:
+            with get_db_connection() as conn:
+                user_check = conn.execute('SELECT 1 FROM Users WHERE UserID = ?', (user_id,)).fetchone()
+            if not user_check:
+                return jsonify({"error": "UserID does not exist in the database!"}), 400
+        except Exception as e:
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
 
     # Proceed with bike insertion only if the user exists
     bike_id = str(uuid.uuid4())
 
+    def add_bike(conn):
+        conn.execute('INSERT INTO Bicycle (BicycleID, Status, Location, Gear, UserID, Latitude, Longitude) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (bike_id, 'Available', location, json.dumps(gear), user_id, latitude, longitude))
+        conn.execute(INDEX_BICYCLE_SQL, (bike_id,))
+
+    def added(_):
+        publish_availability('added', [available_bike(bike_id, location, json.dumps(gear), latitude, longitude)])
+
     try:
-        with get_db_connection() as conn:
-            # Execute the insert operation with retry mechanism
-            execute_with_retry(conn,
-                               'INSERT INTO Bicycle (BicycleID, Status, Location, Gear, UserID) VALUES (?, ?, ?, ?, ?)',
-                               (bike_id, 'Available', location, json.dumps(gear), user_id))
+        execute_write(add_bike, on_commit=added)
         return jsonify({"message": "Bike added successfully!", "bikeID": bike_id}), 201
+    except WriteUnavailable:
+        raise
     except sqlite3.IntegrityError as e:
         return jsonify({"error": f"Failed to insert data due to integrity error: {str(e)}"}), 500
     except Exception as e:
         return jsonify({"error": f"Error occurred: {str(e)}"}), 500
 
+BULK_CHUNK_SIZE = 5000
+BULK_INGEST_FORMATS = {
+    'application/x-ndjson': iter_ndjson,
+    'application/jsonl': iter_ndjson,
+    'text/csv': iter_csv,
+}
+
+# The subset of user_ids present in the Users table
+def existing_user_ids(user_ids):
+    user_ids = list(user_ids)
+    found = set()
+    with get_db_connection() as conn:
+        for start in range(0, len(user_ids), 500):
+            batch = user_ids[start:start + 500]
+            query = f'SELECT UserID FROM Users WHERE UserID IN ({",".join("?" * len(batch))})'
+            found.update(row['UserID'] for row in conn.execute(query, batch))
+    return found
+
+# API to add many bikes at once from an NDJSON or CSV body. Each record has
+# the same fields as /give_rent; results stream back as one JSON line per row.
+@app.route('/bicycles/bulk', methods=['POST'])
+def bulk_give_rent():
+    parse = BULK_INGEST_FORMATS.get(request.mimetype)
+    if parse is None:
+        return jsonify({"error": "Body must be application/x-ndjson or text/csv"}), 415
+
+    default_owner = session_user_id()
+    # request.stream reads a byte at a time when iterated by line
+    records = parse(io.BufferedReader(request.stream, 1 << 16))
+
+    def generate():
+        counts = {'inserted': 0, 'failed': 0}
+        lines = []
+        try:
+            for result in ingest(records, default_owner, existing_user_ids, writer.submit,
+                                 lambda future: writer.wait(future, WRITE_TIMEOUT),
+                                 lambda bikes: publish_availability('added', [
+                                     available_bike(bike_id, params[0], params[1], params[3], params[4])
+                                     for bike_id, params in bikes]),
+                                 chunk_size=BULK_CHUNK_SIZE):
+                if 'error' in result:
+                    counts['failed'] += 1
+                    lines.append(json.dumps(result))
+                else:
+                    # Formatted by hand: json.dumps per row is the hottest part of an ingest
+                    counts['inserted'] += 1
+                    lines.append(f'{{"row": {result["row"]}, "bikeID": "{result["bikeID"]}"}}')
+                if len(lines) >= 1000:
+                    yield '\n'.join(lines) + '\n'
+                    lines = []
+        except WriteUnavailable:
+            lines.append(json.dumps({"error": "Server is busy, remaining rows were not processed."}))
+        lines.append(json.dumps({'summary': counts}))
+        yield '\n'.join(lines) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/rent_bike', methods=['POST'])
 def rent_bike():
     data = request.get_json()
 
     # Extract data from the request
-    user_id = data.get('userID')
+    user_id = session_user_id() or data.get('userID')
     bicycle_id = data.get('bicycleID')
 
     if not user_id or not bicycle_id:
         return jsonify({"error": "Missing userID or bicycleID"}), 400
 
-    conn = get_db_connection()
+    rental_id = str(uuid.uuid4())
+
+    # Compare-and-set: the UPDATE only matches while the bike is still
+    # available, so its row count decides who gets it. The Rents insert
+    # commits in the same transaction. An unknown user trips the
+    # Bicycle.UserID foreign key.
+    def reserve(conn):
+        updated = conn.execute(
+            'UPDATE Bicycle SET Status = "Rented", UserID = ? WHERE BicycleID = ? AND Status = "Available"',
+            (user_id, bicycle_id)).rowcount
+        if not updated:
+            return False
+        conn.execute(UNINDEX_BICYCLE_SQL, (bicycle_id,))
+        conn.execute('INSERT INTO Rents (RentalID, UserID, BicycleID, StartTime) VALUES (?, ?, ?, ?)',
+                     (rental_id, user_id, bicycle_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        return True
+
+    def reserved(ok):
+        if ok:
+            publish_availability('reserved', [{"BicycleID": bicycle_id}])
 
     try:
-        # Check if the user exists
-        user = conn.execute('SELECT * FROM Users WHERE UserID = ?', (user_id,)).fetchone()
-        if not user:
-            return jsonify({"error": "User does not exist!"}), 400
-
-        # Check if the bike is available
-        bike = conn.execute('SELECT * FROM Bicycle WHERE BicycleID = ? AND Status = "Available"', (bicycle_id,)).fetchone()
-        if not bike:
+        if not execute_write(reserve, on_commit=reserved):
             return jsonify({"error": "Bike is not available for rent!"}), 400
+        return jsonify({"message": "Bike rented successfully!", "rentalID": rental_id}), 200
+    except sqlite3.IntegrityError:
+        return jsonify({"error": "User does not exist!"}), 400
+    except sqlite3.Error as e:
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
 
-        # Update the bicycle status to rented
-        conn.execute('UPDATE Bicycle SET Status = "Rented", UserID = ? WHERE BicycleID = ?', (user_id, bicycle_id))
-        conn.commit()
+# Hourly rate from a bike's Gear JSON (None if it has no usable price)
+def gear_rate(gear):
+    try:
+        price = json.loads(gear).get('price')
+    except (TypeError, ValueError, AttributeError):
+        return None
+    return price if isinstance(price, (int, float)) else None
+
+# API to return a rented bike; closes the rental and puts the bike back in service
+@app.route('/return_bicycle', methods=['POST'])
+def return_bicycle():
+    data = request.get_json()
 
-        # Log the rental start time
-        rental_id = str(uuid.uuid4())
-        conn.execute('INSERT INTO Rents (RentalID, UserID, BicycleID, StartTime) VALUES (?, ?, ?, ?)',
-                     (rental_id, user_id, bicycle_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-        conn.commit()
+    user_id = session_user_id() or data.get('userID')
+    bicycle_id = data.get('bicycleID')
+    latitude = data.get('latitude')
+    longitude = data.get('longitude')
 
-        return jsonify({"message": "Bike rented successfully!", "rentalID": rental_id}), 200
+    if not user_id or not bicycle_id:
+        return jsonify({"error": "Missing userID or bicycleID"}), 400
+    if (latitude is not None or longitude is not None) and not valid_coordinates(latitude, longitude):
+        return jsonify({"error": "Invalid latitude/longitude"}), 400
+
+    end_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def close_rental(conn):
+        rental = conn.execute('SELECT RentalID, StartTime FROM Rents '
+                              'WHERE BicycleID = ? AND UserID = ? AND EndTime IS NULL',
+                              (bicycle_id, user_id)).fetchone()
+        if not rental:
+            return None
+        conn.execute('UPDATE Rents SET EndTime = ? WHERE RentalID = ?', (end_time, rental['RentalID']))
+        conn.execute('UPDATE Bicycle SET Status = "Available", '
+                     'Latitude = COALESCE(?, Latitude), Longitude = COALESCE(?, Longitude) '
+                     'WHERE BicycleID = ?', (latitude, longitude, bicycle_id))
+        conn.execute(INDEX_BICYCLE_SQL, (bicycle_id,))
+        bike = conn.execute('SELECT Location, Gear, Latitude, Longitude FROM Bicycle WHERE BicycleID = ?',
+                            (bicycle_id,)).fetchone()
+        return rental['RentalID'], rental['StartTime'], bike
+
+    def returned(closed):
+        if closed is not None:
+            bike = closed[2]
+            publish_availability('returned', [available_bike(bicycle_id, bike['Location'], bike['Gear'],
+                                                             bike['Latitude'], bike['Longitude'])])
+
+    try:
+        closed = execute_write(close_rental, on_commit=returned)
+    except sqlite3.Error as e:
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+    if closed is None:
+        return jsonify({"error": "No open rental for this bike!"}), 400
+
+    rental_id, start_time, bike = closed
+    gear = bike['Gear']
+    minutes = (datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S") -
+               datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")).total_seconds() / 60
+    return jsonify({"message": "Bike returned successfully!", "rentalID": rental_id,
+                    "minutes": round(minutes, 1), "totalCost": fare(minutes, gear_rate(gear))}), 200
+
+# API to price a rental: the running fare of the caller's open rental of the
+# bike, otherwise a quote for one hour
+@app.route('/calculate_rent', methods=['POST'])
+def calculate_rent():
+    data = request.get_json()
+
+    user_id = session_user_id() or data.get('userID')
+    bicycle_id = data.get('bicycleID')
+    if not bicycle_id:
+        return jsonify({"error": "Missing bicycleID"}), 400
+
+    with get_db_connection() as conn:
+        bike = conn.execute('SELECT Gear FROM Bicycle WHERE BicycleID = ?', (bicycle_id,)).fetchone()
+        rental = conn.execute('SELECT StartTime FROM Rents WHERE BicycleID = ? AND UserID = ? AND EndTime IS NULL',
+                              (bicycle_id, user_id)).fetchone() if user_id else None
+    if not bike:
+        return jsonify({"error": "Bike does not exist!"}), 404
+
+    if rental:
+        minutes = (datetime.now() - datetime.strptime(rental['StartTime'], "%Y-%m-%d %H:%M:%S")).total_seconds() / 60
+    else:
+        minutes = 60
+    return jsonify({"message": "Rent calculated", "bikeID": bicycle_id, "minutes": round(minutes, 1),
+                    "totalCost": fare(minutes, gear_rate(bike['Gear']))}), 200
+
+# API to pay for a returned rental. The amount is priced server-side; a
+# charge already written by the settlement run is marked as paid.
+@app.route('/make_payment', methods=['POST'])
+def make_payment():
+    data = request.get_json()
+
+    user_id = session_user_id() or data.get('userID')
+    rental_id = data.get('rentalID')
+    card_number = str(data.get('cardNumber') or '').replace(' ', '')
+
+    if not user_id or not rental_id:
+        return jsonify({"error": "Missing userID or rentalID"}), 400
+    if not re.fullmatch(r'\d{12,19}', card_number):
+        return jsonify({"error": "Invalid card number"}), 400
+    # Only the last four digits are ever stored
+    masked_card = '*' * 12 + card_number[-4:]
+
+    def pay(conn):
+        rental = conn.execute(
+            'SELECT R.StartTime, R.EndTime, B.Gear FROM Rents R LEFT JOIN Bicycle B ON B.BicycleID = R.BicycleID '
+            'WHERE R.RentalID = ? AND R.UserID = ?', (rental_id, user_id)).fetchone()
+        if not rental:
+            return 'missing', None
+        if rental['EndTime'] is None:
+            return 'open', None
+        payment = conn.execute('SELECT PaymentID, Amount, CardNumber FROM Payments WHERE RentalID = ?',
+                               (rental_id,)).fetchone()
+        if payment and payment['CardNumber']:
+            return 'paid', payment['Amount']
+        if payment:
+            conn.execute('UPDATE Payments SET CardNumber = ? WHERE PaymentID = ?',
+                         (masked_card, payment['PaymentID']))
+            return 'ok', payment['Amount']
+        minutes = (datetime.strptime(rental['EndTime'], "%Y-%m-%d %H:%M:%S") -
+                   datetime.strptime(rental['StartTime'], "%Y-%m-%d %H:%M:%S")).total_seconds() / 60
+        amount = fare(minutes, gear_rate(rental['Gear']))
+        conn.execute('INSERT INTO Payments (PaymentID, UserID, RentalID, Amount, PaymentDate, CardNumber) '
+                     'VALUES (?, ?, ?, ?, ?, ?)',
+                     (str(uuid.uuid4()), user_id, rental_id, amount,
+                      datetime.now().strftime("%Y-%m-%d %H:%M:%S"), masked_card))
+        return 'ok', amount
+
+    try:
+        status, amount = execute_write(pay)
     except sqlite3.Error as e:
         return jsonify({"error": f"Database error: {str(e)}"}), 500
-    finally:
-        conn.close()
+    if status == 'missing':
+        return jsonify({"error": "Rental not found!"}), 404
+    if status == 'open':
+        return jsonify({"error": "Return the bike before paying."}), 400
+    if status == 'paid':
+        return jsonify({"error": "Rental is already paid.", "amount": amount}), 409
+    return jsonify({"message": f"Payment of Rs {amount:.2f} successful!", "amount": amount}), 200
+
+
+# Writer, pool and change-feed state, read when /metrics is scraped
+def runtime_metrics():
+    w = writer.stats()
+    batch_sizes = Histogram(tuple(w['batch_size_histogram']))
+    batch_sizes.counts = list(w['batch_size_histogram'].values()) + [0]
+    batch_sizes.sum = w['jobs']
+    yield 'db_writer_queue_depth', 'gauge', 'Writes queued for the writer thread.', [({}, w['queue_depth'])]
+    yield 'db_writer_batch_size', 'histogram', 'Jobs group-committed per transaction.', [({}, batch_sizes)]
+    yield 'db_writer_failed_jobs_total', 'counter', 'Write jobs that raised.', [({}, w['failed_jobs'])]
+    yield 'db_writer_batch_seconds_total', 'counter', 'Time spent applying and committing batches.', [({}, w['batch_seconds'])]
+    yield 'db_writer_lock_retries_total', 'counter', 'Batches retried after "database is locked".', [({}, w['lock_retries'])]
+    yield 'db_writer_lock_sleep_seconds_total', 'counter', 'Backoff slept before lock retries.', [({}, w['lock_sleep_seconds'])]
+    pool = db_pool.stats()
+    yield 'db_pool_connections', 'gauge', 'Pooled read connections by state.', [
+        ({'state': 'idle'}, pool['idle']), ({'state': 'in_use'}, pool['created'] - pool['idle'])]
+    passwords = password_pool.stats()
+    yield 'password_pool_pending', 'gauge', 'bcrypt jobs queued or running.', [({}, passwords['pending'])]
+    yield 'password_pool_rejected_total', 'counter', 'bcrypt jobs refused with 503.', [({}, passwords['rejected'])]
+    yield 'password_pool_restarts_total', 'counter', 'bcrypt pools replaced after a worker died.', [({}, passwords['restarts'])]
+    yield 'availability_changes_total', 'counter', 'Availability changes published.', [({}, changes.latest)]
+    yield 'availability_log_bytes', 'gauge', 'Encoded changes retained for /bicycles/stream resumes.', [({}, changes.retained_bytes)]
+    yield 'availability_subscribers', 'gauge', 'Open /bicycles/stream connections.', [({}, changes.subscribers)]
+
+metrics.add_collector(runtime_metrics)
+
+# Prometheus scrape endpoint
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 # Run the app
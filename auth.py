@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+
+class PasswordPoolBusy(Exception):
+    """Every password worker is busy and the backlog is at its limit."""
+
+
+class InvalidSession(Exception):
+    """A session token was presented but is forged, malformed or expired."""
+
+
+# Run in the worker processes
+def _hash_password(password):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+
+
+def _check_password(password, hashed):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed)
+
+
+def _worker_context():
+    # The app already runs threads (the writer, the pool's manager) by the
+    # time workers start, and forking copies any lock they hold. Workers are
+    # forked from a single-threaded server that has preloaded only this
+    # module, or spawned where there is no forkserver. Either way a worker
+    # still re-imports a script run directly as __mp_main__, so that script
+    # must keep its own setup (threads, files, sockets) out of that import.
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+class PasswordPool:
+    """bcrypt hashing and verification on a bounded process pool.
+
+    bcrypt is deliberately slow CPU work; running it in the request thread
+    lets a burst of logins starve every other route. At most ``max_pending``
+    jobs may be queued or running at once; beyond that ``PasswordPoolBusy`` is
+    raised so the caller can answer 503 instead of queueing without bound.
+
+    A worker that dies (OOM kill, crash) breaks its executor for good, so a
+    broken executor is replaced and the job tried once more on the new one.
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+        self._restarts = 0
+
+    def _pool(self):
+        # Started on first use so importing the app does not start workers.
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_worker_context())
+        return self._executor
+
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self._restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        for _ in range(2):
+            executor = self._pool()
+            try:
+                return self._submit(executor, fn, *args)
+            except BrokenProcessPool:
+                self._discard(executor)
+        raise PasswordPoolBusy()
+
+    def _submit(self, executor, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PasswordPoolBusy()
+        with self._lock:
+            self._pending += 1
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future.result()
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash_password, password)
+
+    def check(self, password, hashed):
+        return self._run(_check_password, password, hashed)
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'max_pending': self.max_pending,
+                    'pending': self._pending, 'rejected': self._rejected,
+                    'restarts': self._restarts}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+
+
+class SessionTokens:
+    """Signed, expiring tokens carrying a user ID."""
+
+    def __init__(self, secret_key, max_age=24 * 3600):
+        self.max_age = max_age
+        self._serializer = URLSafeTimedSerializer(secret_key, salt='session')
+
+    def issue(self, user_id):
+        return self._serializer.dumps({'uid': user_id})
+
+    def verify(self, token):
+        try:
+            return self._serializer.loads(token, max_age=self.max_age)['uid']
+        except (BadSignature, SignatureExpired, KeyError, TypeError):
+            return None
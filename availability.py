@@ -0,0 +1,162 @@
+import itertools
+import json
+import threading
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# Distinguishes this process's versions and event ids from a previous run's
+BOOT_ID = uuid.uuid4().hex[:12]
+
+
+class AvailabilityCache:
+    """In-process cache of rendered /bicycles pages.
+
+    Every write that changes which bikes are available calls ``bump()``; that
+    advances the version and drops every cached page. The version doubles as
+    the listing's ETag, prefixed with a per-process id so a restart never
+    revalidates a client's stale copy.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self._version
+
+    def etag(self, version):
+        return f'{BOOT_ID}-{version}'
+
+    def bump(self, version=None):
+        # `version` lets the change log's sequence number be the version.
+        with self._lock:
+            self._version = self._version + 1 if version is None else max(self._version, version)
+            self._entries.clear()
+            return self._version
+
+    def get(self, version, key):
+        with self._lock:
+            if version != self._version:
+                return None
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, version, key, value):
+        with self._lock:
+            # A write landed while this page was being built; don't cache it
+            # under the new version.
+            if version != self._version:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class ChangeLog:
+    """Bounded, in-process log of availability changes.
+
+    Each ``publish`` gets the next sequence number. Readers keep their own
+    position and ask for ``since(seq)``, blocking in ``wait`` between
+    changes, or are woken by a listener (see StreamServer). All of them
+    share one Condition, so an idle subscriber needs no queue of its own.
+
+    At most ``retain`` events and ``retain_bytes`` of encoded data are kept
+    (a bulk ingest publishes thousands of bikes in one event); the newest
+    event always stays. Readers that fall behind the oldest one get None
+    from ``since`` and start over.
+    """
+
+    def __init__(self, retain=10000, retain_bytes=16 << 20):
+        self.retain = retain
+        self.retain_bytes = retain_bytes
+        self._events = deque()
+        self._bytes = 0
+        self._seq = 0
+        self._changed = threading.Condition()
+        self._listeners = []
+        self.subscribers = 0
+
+    @property
+    def latest(self):
+        return self._seq
+
+    @property
+    def retained_bytes(self):
+        return self._bytes
+
+    def event_id(self, seq):
+        return f'{BOOT_ID}-{seq}'
+
+    def parse_event_id(self, event_id):
+        """Sequence number of an id from this process, else None."""
+        boot, _, seq = (event_id or '').rpartition('-')
+        if boot != BOOT_ID or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def publish(self, kind, bikes):
+        data = json.dumps(bikes)
+        with self._changed:
+            self._seq += 1
+            self._events.append((self._seq, kind, data))
+            self._bytes += len(data)
+            while len(self._events) > 1 and (len(self._events) > self.retain or self._bytes > self.retain_bytes):
+                self._bytes -= len(self._events.popleft()[2])
+            self._changed.notify_all()
+            seq = self._seq
+        for listener in self._listeners:
+            listener()
+        return seq
+
+    def add_listener(self, listener):
+        """Call ``listener()`` after every publish, e.g. to wake an event loop."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def since(self, seq):
+        """Events after ``seq``, or None if some were already dropped."""
+        with self._changed:
+            if seq >= self._seq:
+                return []
+            if not self._events or self._events[0][0] > seq + 1:
+                return None
+            return list(itertools.islice(self._events, seq + 1 - self._events[0][0], None))
+
+    def read(self, seq):
+        """(new position, Server-Sent Events text) for a reader at ``seq``.
+
+        The text is empty when nothing changed since ``seq``, and a "reset"
+        event at the latest position when ``seq`` is None or its events
+        were already dropped.
+        """
+        events = None if seq is None else self.since(seq)
+        if events is None:
+            seq = self.latest
+            return seq, f'id: {self.event_id(seq)}\nevent: reset\ndata: {{}}\n\n'
+        if not events:
+            return seq, ''
+        return events[-1][0], ''.join(f'id: {self.event_id(s)}\nevent: {kind}\ndata: {data}\n\n'
+                                      for s, kind, data in events)
+
+    @contextmanager
+    def subscription(self):
+        with self._changed:
+            self.subscribers += 1
+        try:
+            yield
+        finally:
+            with self._changed:
+                self.subscribers -= 1
+
+    def wait(self, seq, timeout):
+        with self._changed:
+            return self._changed.wait_for(lambda: self._seq > seq, timeout)
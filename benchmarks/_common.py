@@ -0,0 +1,100 @@
+import json
+import os
+import statistics
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import bcrypt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Known password for every seeded user; cheap bcrypt rounds keep seeding fast.
+PASSWORD = 'Passw0rd!'
+SEED_ROUNDS = 4
+
+
+def load_app(database=None):
+    # Point the app at a scratch database before it is imported so benchmarks
+    # never touch the checked-in bicycleRental.db.
+    if database is None:
+        database = os.path.join(tempfile.mkdtemp(prefix='spindle-bench-'), 'bench.db')
+    os.environ['BICYCLE_DB'] = database
+    import app
+    return app
+
+
+def seed(database, users=100, bikes=1000, rounds=SEED_ROUNDS):
+    conn = sqlite3.connect(database)
+    conn.execute('PRAGMA journal_mode = WAL')
+    hashed = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds))
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    conn.executemany(
+        'INSERT INTO Users (UserID, Name, EmailID, PhoneNo, Password, DOB) VALUES (?, ?, ?, ?, ?, ?)',
+        ((uid, f'user{i}', f'user{i}@example.com', '0000000000', hashed, '1990-01-01')
+         for i, uid in enumerate(user_ids)))
+    conn.commit()
+    conn.close()
+    return user_ids, add_bikes(database, user_ids, bikes)
+
+
+def add_bikes(database, user_ids, count):
+    conn = sqlite3.connect(database)
+    bike_ids = [str(uuid.uuid4()) for _ in range(count)]
+    gear = json.dumps({'name': 'Roadster', 'type': 'city', 'price': 20.0})
+    conn.executemany(
+        'INSERT INTO Bicycle (BicycleID, Status, Location, Gear, UserID) VALUES (?, ?, ?, ?, ?)',
+        ((bid, 'Available', f'Dock {i % 50}', gear, user_ids[i % len(user_ids)])
+         for i, bid in enumerate(bike_ids)))
+    conn.commit()
+    conn.close()
+    return bike_ids
+
+
+def percentiles(samples):
+    if not samples:
+        return {'p50': None, 'p95': None, 'p99': None}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99),
+            'mean': statistics.fmean(ordered)}
+
+
+def run_concurrent(fn, threads, duration):
+    """Call ``fn(thread_index)`` in a loop from ``threads`` threads for
+    ``duration`` seconds. Returns (calls, latencies_ms, elapsed_seconds)."""
+    latencies = [[] for _ in range(threads)]
+    stop = threading.Event()
+
+    def worker(index):
+        record = latencies[index].append
+        while not stop.is_set():
+            start = time.perf_counter()
+            fn(index)
+            record((time.perf_counter() - start) * 1000)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    time.sleep(duration)
+    stop.set()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    merged = [x for per_thread in latencies for x in per_thread]
+    return len(merged), merged, elapsed
+
+
+def report(name, calls, latencies, elapsed):
+    stats = percentiles(latencies)
+    line = f'{name:<40} {calls / elapsed:>10.1f} req/s'
+    if stats['p50'] is not None:
+        line += f"   p50 {stats['p50']:.2f} ms  p95 {stats['p95']:.2f} ms  p99 {stats['p99']:.2f} ms"
+    print(line)
+    return calls / elapsed
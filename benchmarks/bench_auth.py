@@ -0,0 +1,87 @@
+"""Login throughput versus password worker count, and /bicycles latency while
+a login storm is running, with bcrypt inline in the request thread versus on
+the password process pool.
+
+    python -m benchmarks.bench_auth [--rounds 10] [--duration 5] [--storm-threads 16]
+"""
+import argparse
+import os
+import time
+
+import bcrypt
+
+from auth import PasswordPool
+from benchmarks._common import PASSWORD, load_app, percentiles, report, run_concurrent, seed
+
+
+class InlinePasswords:
+    # The behaviour before the pool: bcrypt on the calling thread.
+    def hash(self, password):
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+
+    def check(self, password, hashed):
+        return bcrypt.checkpw(password.encode('utf-8'), hashed)
+
+    def shutdown(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=10, help='bcrypt cost of the seeded users')
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--storm-threads', type=int, default=16)
+    args = parser.parse_args()
+
+    app = load_app()
+    seed(app.DATABASE, users=50, bikes=200, rounds=args.rounds)
+    client = app.app.test_client()
+    original = app.password_pool
+    busy = [0]
+
+    def login(i):
+        response = client.post('/login_user', json={'emailID': f'user{i % 50}@example.com',
+                                                    'password': PASSWORD})
+        if response.status_code == 503:
+            # A well-behaved client backs off instead of hammering the server.
+            busy[0] += 1
+            time.sleep(0.1)
+
+    print('login throughput by worker count')
+    workers = 1
+    cores = os.cpu_count() or 1
+    while True:
+        app.password_pool = PasswordPool(workers=workers, max_pending=workers * 64)
+        app.password_pool.check(PASSWORD, bcrypt.hashpw(b'x', bcrypt.gensalt(4)))  # start workers
+        report(f'  {workers} worker(s)', *run_concurrent(login, workers * 2, args.duration))
+        app.password_pool.shutdown()
+        if workers >= cores:
+            break
+        workers = min(workers * 2, cores)
+
+    print(f'/bicycles latency during a {args.storm_threads}-thread login storm')
+    for label, passwords in (('inline bcrypt', InlinePasswords()), ('password pool', PasswordPool())):
+        app.password_pool = passwords
+        busy[0] = 0
+        probe = []
+
+        def mixed(i):
+            if i == 0:
+                probe.append(None)
+                client.get('/bicycles')
+            else:
+                login(i)
+
+        calls, latencies, elapsed = run_concurrent(mixed, args.storm_threads + 1, args.duration)
+        # run_concurrent merges all threads; thread 0 is the /bicycles probe.
+        probe_latencies = latencies[:len(probe)]
+        stats = percentiles(probe_latencies)
+        print(f'  {label:<14} /bicycles {len(probe) / elapsed:8.1f} req/s  '
+              f'p50 {stats["p50"]:.2f} ms  p99 {stats["p99"]:.2f} ms   '
+              f'logins {calls - len(probe)} ({busy[0]} shed with 503)')
+        passwords.shutdown()
+    app.password_pool = original
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""/bicycles latency as the fleet grows: the old full scan versus a cached
+page, an uncached keyset page, a 304 revalidation and the streamed full list.
+
+    python -m benchmarks.bench_bicycles [--fleet 1000 10000 100000 300000] [--repeat 20]
+"""
+import argparse
+import json
+import time
+
+from benchmarks._common import add_bikes, load_app, percentiles, seed
+
+LEGACY_QUERY = '''
+    SELECT B.BicycleID, B.Status, B.Location, B.Gear, U.Name AS OwnerName
+    FROM Bicycle B
+    LEFT JOIN Users U ON B.UserID = U.UserID
+    WHERE B.Status = "Available"
+'''
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return percentiles(samples)['p50']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fleet', type=int, nargs='+', default=[1000, 10000, 100000, 300000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--page', type=int, default=100)
+    args = parser.parse_args()
+
+    app = load_app()
+    user_ids, _ = seed(app.DATABASE, users=100, bikes=0)
+    client = app.app.test_client()
+    size = 0
+
+    print(f'{"fleet":>8} {"full scan":>12} {"page (miss)":>12} {"page (hit)":>12} '
+          f'{"304":>8} {"stream all":>12}   (p50 ms)')
+    for fleet in args.fleet:
+        add_bikes(app.DATABASE, user_ids, fleet - size)
+        size = fleet
+        app.availability.bump()
+
+        def legacy():
+            with app.get_db_connection() as conn:
+                rows = conn.execute(LEGACY_QUERY).fetchall()
+            json.dumps([dict(row) for row in rows])
+
+        def page_miss():
+            app.availability.bump()
+            client.get(f'/bicycles?limit={args.page}')
+
+        def page_hit():
+            client.get(f'/bicycles?limit={args.page}')
+
+        etag = client.get(f'/bicycles?limit={args.page}').headers['ETag']
+
+        def not_modified():
+            client.get(f'/bicycles?limit={args.page}', headers={'If-None-Match': etag})
+
+        def stream_all():
+            response = client.get('/bicycles', buffered=False)
+            for _ in response.response:
+                pass
+            response.close()
+
+        full_repeat = max(1, args.repeat // 5)
+        print(f'{fleet:>8} {timed(legacy, full_repeat):>12.2f} {timed(page_miss, args.repeat):>12.2f} '
+              f'{timed(page_hit, args.repeat):>12.2f} {timed(not_modified, args.repeat):>8.2f} '
+              f'{timed(stream_all, full_repeat):>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
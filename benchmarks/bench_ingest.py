@@ -0,0 +1,70 @@
+"""Bulk fleet ingest rate through /bicycles/bulk for NDJSON and CSV bodies,
+against one /give_rent POST per bike.
+
+    python -m benchmarks.bench_ingest [--bikes 200000] [--owners 1000]
+"""
+import argparse
+import io
+import json
+import random
+import time
+
+from benchmarks._common import load_app, seed
+
+
+def ndjson_body(owners, count, rng):
+    lines = []
+    for i in range(count):
+        lines.append(json.dumps({
+            'userID': owners[i % len(owners)], 'location': f'Depot {i % 40}',
+            'gear': {'name': 'Roadster', 'type': 'city', 'price': 20},
+            'latitude': 12.8 + rng.random() * 0.3, 'longitude': 77.4 + rng.random() * 0.3,
+        }))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def csv_body(owners, count, rng):
+    lines = ['userID,location,name,type,price,latitude,longitude']
+    for i in range(count):
+        lines.append(f'{owners[i % len(owners)]},Depot {i % 40},Roadster,city,20,'
+                     f'{12.8 + rng.random() * 0.3:.6f},{77.4 + rng.random() * 0.3:.6f}')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bikes', type=int, default=200000)
+    parser.add_argument('--owners', type=int, default=1000)
+    parser.add_argument('--single', type=int, default=2000, help='bikes added one POST at a time')
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    app = load_app()
+    owners, _ = seed(app.DATABASE, users=args.owners, bikes=0)
+    client = app.app.test_client()
+
+    for label, content_type, body in (
+            ('NDJSON', 'application/x-ndjson', ndjson_body(owners, args.bikes, rng)),
+            ('CSV', 'text/csv', csv_body(owners, args.bikes, rng))):
+        start = time.perf_counter()
+        response = client.post('/bicycles/bulk', input_stream=io.BytesIO(body),
+                               content_type=content_type, content_length=len(body), buffered=False)
+        last = b''
+        for chunk in response.response:
+            last = chunk
+        response.close()
+        elapsed = time.perf_counter() - start
+        summary = json.loads(last.decode('utf-8').strip().splitlines()[-1])['summary']
+        print(f'bulk {label:<7} {summary["inserted"]:>8} bikes in {elapsed:6.2f}s  '
+              f'{summary["inserted"] / elapsed:>10.0f} bikes/s  ({summary["failed"]} failed)')
+
+    start = time.perf_counter()
+    for i in range(args.single):
+        client.post('/give_rent', json={'userID': owners[i % len(owners)], 'location': 'Depot',
+                                        'gear': {'name': 'Roadster', 'type': 'city', 'price': 20}})
+    elapsed = time.perf_counter() - start
+    print(f'/give_rent    {args.single:>8} bikes in {elapsed:6.2f}s  {args.single / elapsed:>10.0f} bikes/s')
+
+
+if __name__ == '__main__':
+    main()
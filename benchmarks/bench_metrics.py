@@ -0,0 +1,69 @@
+"""Cost of the /metrics instrumentation on the hot routes: the same requests
+with recording on and off, in short interleaved blocks so scheduler noise and
+drift hit both sides equally.
+
+    python -m benchmarks.bench_metrics [--fleet 10000] [--block 50] [--rounds 100]
+"""
+import argparse
+import random
+import sqlite3
+import statistics
+import time
+
+from benchmarks._common import load_app, seed
+from spatial import REBUILD_INDEX_SQL
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fleet', type=int, default=10000)
+    parser.add_argument('--block', type=int, default=50, help='requests per timed block')
+    parser.add_argument('--rounds', type=int, default=100, help='on/off block pairs per route')
+    args = parser.parse_args()
+
+    app = load_app()
+    user_ids, bike_ids = seed(app.DATABASE, users=100, bikes=args.fleet)
+    conn = sqlite3.connect(app.DATABASE)
+    conn.execute('UPDATE Bicycle SET Latitude = 12.8 + (abs(random()) % 30000) / 100000.0, '
+                 'Longitude = 77.4 + (abs(random()) % 30000) / 100000.0')
+    conn.execute(REBUILD_INDEX_SQL)
+    conn.commit()
+    conn.close()
+    client = app.app.test_client()
+    rng = random.Random(5)
+
+    def page_miss():
+        app.availability.bump()
+        client.get('/bicycles?limit=100')
+
+    routes = {
+        '/bicycles (cached page)': lambda: client.get('/bicycles?limit=100'),
+        '/bicycles (query + encode)': page_miss,
+        '/bicycles/nearby': lambda: client.get(f'/bicycles/nearby?lat={12.8 + rng.random() * 0.3}'
+                                               f'&lon={77.4 + rng.random() * 0.3}&limit=20'),
+        '/calculate_rent': lambda: client.post('/calculate_rent', json={
+            'userID': user_ids[0], 'bicycleID': rng.choice(bike_ids)}),
+    }
+
+    # CPU time of this process: other tenants' load does not count against it
+    def timed(fn, enabled):
+        app.metrics.enabled = enabled
+        start = time.process_time()
+        for _ in range(args.block):
+            fn()
+        return (time.process_time() - start) / args.block * 1e6
+
+    print(f'{"route":<28} {"off (us)":>9} {"on (us)":>9} {"overhead":>9}')
+    for name, fn in routes.items():
+        timed(fn, True)
+        off, on = [], []
+        for i in range(args.rounds):
+            for enabled in ((True, False) if i % 2 else (False, True)):
+                (on if enabled else off).append(timed(fn, enabled))
+        off_us, on_us = statistics.median(off), statistics.median(on)
+        print(f'{name:<28} {off_us:>9.1f} {on_us:>9.1f} {(on_us / off_us - 1) * 100:>8.2f}%')
+    app.metrics.enabled = True
+
+
+if __name__ == '__main__':
+    main()
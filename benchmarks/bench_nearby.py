@@ -0,0 +1,95 @@
+"""k-nearest available bikes over a synthetic city: R*Tree-backed
+/bicycles/nearby versus pulling every available bike and filtering it.
+
+    python -m benchmarks.bench_nearby [--bikes 1000000] [--queries 500]
+"""
+import argparse
+import heapq
+import json
+import random
+import sqlite3
+import time
+import uuid
+
+from benchmarks._common import load_app, percentiles, seed
+from spatial import REBUILD_INDEX_SQL, haversine_m
+
+# Roughly a 30 km x 30 km metro area
+CENTER_LAT, CENTER_LON = 12.97, 77.59
+SPAN_DEG = 0.27
+
+
+def populate(database, user_ids, count, rng):
+    conn = sqlite3.connect(database)
+    gear = json.dumps({'name': 'Roadster', 'type': 'city', 'price': 20.0})
+    chunk = 100000
+    for start in range(0, count, chunk):
+        conn.executemany(
+            'INSERT INTO Bicycle (BicycleID, Status, Location, Gear, UserID, Latitude, Longitude) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ((str(uuid.uuid4()), 'Available' if rng.random() < 0.8 else 'Rented', 'Street',
+              gear, user_ids[i % len(user_ids)],
+              CENTER_LAT + (rng.random() - 0.5) * SPAN_DEG,
+              CENTER_LON + (rng.random() - 0.5) * SPAN_DEG)
+             for i in range(start, min(count, start + chunk))))
+    conn.execute('DELETE FROM BicycleLocation')
+    conn.execute(REBUILD_INDEX_SQL)
+    conn.commit()
+    conn.close()
+
+
+def random_point(rng):
+    return (CENTER_LAT + (rng.random() - 0.5) * SPAN_DEG,
+            CENTER_LON + (rng.random() - 0.5) * SPAN_DEG)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bikes', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--scan-queries', type=int, default=3)
+    parser.add_argument('--radius', type=float, default=2000.0)
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    app = load_app()
+    user_ids, _ = seed(app.DATABASE, users=100, bikes=0)
+    started = time.perf_counter()
+    populate(app.DATABASE, user_ids, args.bikes, rng)
+    print(f'seeded {args.bikes} bikes in {time.perf_counter() - started:.1f}s')
+    client = app.app.test_client()
+
+    samples = []
+    for _ in range(args.queries):
+        lat, lon = random_point(rng)
+        start = time.perf_counter()
+        response = client.get(f'/bicycles/nearby?lat={lat}&lon={lon}'
+                              f'&radius={args.radius}&limit={args.limit}')
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200
+    stats = percentiles(samples)
+    print(f'R*Tree /bicycles/nearby   p50 {stats["p50"]:.2f} ms  p95 {stats["p95"]:.2f} ms  '
+          f'p99 {stats["p99"]:.2f} ms')
+
+    # The alternative without a spatial index: fetch every available bike and
+    # rank them all, as a client filtering the /bicycles list would.
+    samples = []
+    for _ in range(args.scan_queries):
+        lat, lon = random_point(rng)
+        start = time.perf_counter()
+        with app.get_db_connection() as conn:
+            rows = conn.execute(
+                "SELECT BicycleID, Latitude, Longitude FROM Bicycle WHERE Status = 'Available'").fetchall()
+        heapq.nsmallest(args.limit, (
+            (d, row['BicycleID']) for row in rows
+            for d in (haversine_m(lat, lon, row['Latitude'], row['Longitude']),)
+            if d <= args.radius))
+        samples.append((time.perf_counter() - start) * 1000)
+    stats = percentiles(samples)
+    print(f'scan and filter           p50 {stats["p50"]:.2f} ms  (mean of {args.scan_queries}: '
+          f'{stats["mean"]:.2f} ms)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Requests/sec for /bicycles and /login_user with the old open-per-request
+connection handling versus the pooled WAL connections.
+
+    python -m benchmarks.bench_pool [--threads 8] [--duration 5]
+"""
+import argparse
+import sqlite3
+from contextlib import contextmanager
+
+from benchmarks._common import PASSWORD, load_app, report, run_concurrent, seed
+
+
+@contextmanager
+def open_per_request(database):
+    # What get_db_connection() used to do on every request.
+    conn = sqlite3.connect(database, timeout=10.0)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA foreign_keys = ON')
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--bikes', type=int, default=200)
+    args = parser.parse_args()
+
+    app = load_app()
+    seed(app.DATABASE, users=args.users, bikes=args.bikes)
+    client = app.app.test_client()
+    pooled = app.get_db_connection
+
+    def bicycles(_):
+        # Invalidate the page cache so every request queries a connection
+        app.availability.bump()
+        response = client.get('/bicycles')
+        assert response.status_code == 200
+
+    def login(i):
+        client.post('/login_user', json={'emailID': f'user{i % args.users}@example.com',
+                                         'password': PASSWORD})
+
+    results = {}
+    for label, factory in (('open-per-request', lambda: open_per_request(app.DATABASE)),
+                           ('pooled', pooled)):
+        app.get_db_connection = factory
+        for route, fn in (('/bicycles', bicycles), ('/login_user', login)):
+            results[label, route] = report(f'{label:<18} {route}',
+                                           *run_concurrent(fn, args.threads, args.duration))
+    app.get_db_connection = pooled
+
+    for route in ('/bicycles', '/login_user'):
+        before, after = results['open-per-request', route], results['pooled', route]
+        print(f'{route}: {after / before:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
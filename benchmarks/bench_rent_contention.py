@@ -0,0 +1,83 @@
+"""Many threads racing /rent_bike for a handful of hot BicycleIDs.
+
+Each round puts the hot bikes back to Available and lets every thread try to
+rent random ones until the round's attempt budget is spent. Reports
+throughput, latency percentiles and verifies that no bike was booked twice in
+a round, both from the HTTP responses and from the Rents table.
+
+    python -m benchmarks.bench_rent_contention [--threads 16] [--bikes 5] [--rounds 50]
+"""
+import argparse
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from benchmarks._common import load_app, percentiles, seed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--bikes', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--attempts', type=int, default=20, help='attempts per thread per round')
+    args = parser.parse_args()
+
+    app = load_app()
+    user_ids, bike_ids = seed(app.DATABASE, users=args.threads, bikes=args.bikes)
+    client = app.app.test_client()
+
+    latencies = []
+    won = Counter()
+    outcomes = Counter()
+    lock = threading.Lock()
+    elapsed = 0.0
+
+    for round_no in range(args.rounds):
+        app.execute_write(lambda conn: conn.execute('UPDATE Bicycle SET Status = "Available"'))
+        barrier = threading.Barrier(args.threads)
+
+        def worker(index):
+            rng = random.Random(round_no * 1000 + index)
+            local = []
+            barrier.wait()
+            for _ in range(args.attempts):
+                bike = rng.choice(bike_ids)
+                start = time.perf_counter()
+                response = client.post('/rent_bike', json={'userID': user_ids[index], 'bicycleID': bike})
+                local.append((time.perf_counter() - start) * 1000)
+                with lock:
+                    outcomes[response.status_code] += 1
+                    if response.status_code == 200:
+                        won[round_no, bike] += 1
+            with lock:
+                latencies.extend(local)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed += time.perf_counter() - started
+
+    conn = sqlite3.connect(app.DATABASE)
+    rents = conn.execute('SELECT COUNT(*) FROM Rents').fetchone()[0]
+    conn.close()
+
+    double_booked = sum(1 for count in won.values() if count > 1)
+    stats = percentiles(latencies)
+    print(f'requests        {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.1f} req/s)')
+    print(f'latency         p50 {stats["p50"]:.2f} ms  p95 {stats["p95"]:.2f} ms  p99 {stats["p99"]:.2f} ms')
+    print(f'status codes    {dict(outcomes)}')
+    print(f'successful      {sum(won.values())} (max possible {args.rounds * args.bikes})')
+    print(f'Rents rows      {rents}')
+    print(f'double-booked   {double_booked}')
+    if double_booked or rents != sum(won.values()):
+        raise SystemExit('FAIL: a bike was booked more than once')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""Replay a traffic capture (RECORD_REQUESTS=<file> on a running app) against
+a freshly seeded synthetic database and report per-route throughput and
+latency percentiles as JSON, so two runs can be diffed for regressions.
+
+    python -m benchmarks.bench_replay [--capture requests.jsonl] [--users 1000] [--bikes 10000]
+        [--concurrency 8] [--rate 0] [--loops 1] [--target client|server] [--output report.json]
+
+Recorded user, email and bike ids are remapped onto the seeded ones. Lines
+without a "path" field are skipped, so the capture can share a file with
+other JSON lines; with no usable lines, --synthetic requests of a typical
+mix are generated instead. With --rate, latency is measured from each
+request's scheduled start, so a stalled server cannot hide queueing delay.
+Later --loops resend the same bodies, so repeated sign-ups and rentals of an
+already rented bike come back 400, as they would in production.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from benchmarks._common import PASSWORD, load_app, percentiles, seed
+from recorder import RECORDED_ROUTES, REDACTED
+
+WRONG_PASSWORD = 'Wr0ngPassword'
+
+
+def load_capture(path):
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if (isinstance(record, dict) and 'path' in record
+                    and (record.get('method', 'GET'), record['path']) in RECORDED_ROUTES):
+                records.append(record)
+    return records
+
+
+def synthetic_capture(count, users, rng):
+    # Mostly browsing, then logins, rentals, new bikes and the odd sign-up
+    records = []
+    for i in range(count):
+        user = f'user-{rng.randrange(users)}'
+        roll = rng.random()
+        if roll < 0.6:
+            records.append({'method': 'GET', 'path': '/bicycles', 'query': 'limit=100', 'status': 200})
+        elif roll < 0.75:
+            records.append({'method': 'POST', 'path': '/login_user', 'status': 200,
+                            'body': {'emailID': user, 'password': REDACTED}})
+        elif roll < 0.88:
+            records.append({'method': 'POST', 'path': '/rent_bike', 'status': 200,
+                            'body': {'userID': user, 'bicycleID': f'bike-{i}'}})
+        elif roll < 0.98:
+            records.append({'method': 'POST', 'path': '/give_rent', 'status': 201,
+                            'body': {'userID': user, 'location': f'Dock {i % 50}',
+                                     'gear': {'name': 'Roadster', 'type': 'city', 'price': 20}}})
+        else:
+            records.append({'method': 'POST', 'path': '/register', 'status': 201, 'body': {}})
+    return records
+
+
+class Remapper:
+    """Rewrites recorded requests to refer to the seeded users and bikes."""
+
+    def __init__(self, user_ids, bike_ids, rng):
+        self.user_ids = user_ids
+        self.users = {}
+        self.emails = {}
+        self.bikes = {}
+        self.free_bikes = list(bike_ids)
+        rng.shuffle(self.free_bikes)
+        self.all_bikes = itertools.cycle(bike_ids)
+        self.registered = itertools.count()
+        self.run = f'{os.getpid()}-{int(time.time())}'
+
+    def user(self, recorded):
+        if recorded not in self.users:
+            self.users[recorded] = self.user_ids[len(self.users) % len(self.user_ids)]
+        return self.users[recorded]
+
+    def email(self, recorded):
+        if recorded not in self.emails:
+            self.emails[recorded] = f'user{len(self.emails) % len(self.user_ids)}@example.com'
+        return self.emails[recorded]
+
+    def bike(self, recorded):
+        # Each recorded bike gets a bike of its own while unused ones last
+        if recorded not in self.bikes:
+            self.bikes[recorded] = self.free_bikes.pop() if self.free_bikes else next(self.all_bikes)
+        return self.bikes[recorded]
+
+    def request(self, record):
+        """(route label, method, url, JSON body) for one recorded line."""
+        method, path = record.get('method', 'GET'), record['path']
+        body = dict(record.get('body') or {})
+        if path == '/register':
+            n = next(self.registered)
+            body = {'name': f'Replay {n}', 'emailID': f'replay-{self.run}-{n}@example.com',
+                    'phoneNo': '0000000000', 'password': PASSWORD, 'DOB': '1990-01-01'}
+        elif path == '/login_user':
+            body['emailID'] = self.email(body.get('emailID'))
+            body['password'] = PASSWORD if record.get('status') == 200 else WRONG_PASSWORD
+        elif path in ('/give_rent', '/rent_bike'):
+            body['userID'] = self.user(body.get('userID'))
+            if path == '/rent_bike':
+                body['bicycleID'] = self.bike(body.get('bicycleID'))
+        query = record.get('query') or ''
+        url = path + ('?' + query if query else '')
+        return f'{method} {path}', method, url, (body if method != 'GET' else None)
+
+
+class ClientTarget:
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def send(self, method, url, body):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.app.test_client()
+        response = client.open(url, method=method, json=body)
+        response.get_data()
+        response.close()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class ServerTarget:
+    # The app behind werkzeug's threaded server on a free local port
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        self.server = make_server('127.0.0.1', 0, app.app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.port = self.server.server_port
+
+    def send(self, method, url, body):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        try:
+            payload = json.dumps(body).encode('utf-8') if body is not None else None
+            headers = {'Content-Type': 'application/json'} if payload is not None else {}
+            conn.request(method, url, body=payload, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+
+    def close(self):
+        self.server.shutdown()
+
+
+def replay(target, requests, concurrency, rate, loops):
+    total = len(requests) * loops
+    tickets = itertools.count()
+    results = defaultdict(list)     # route -> [(latency_ms, status)]
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def worker():
+        local = defaultdict(list)
+        for i in tickets:
+            if i >= total:
+                break
+            route, method, url, body = requests[i % len(requests)]
+            if rate:
+                scheduled = started + i / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                scheduled = time.perf_counter()
+            try:
+                status = target.send(method, url, body)
+            except Exception:
+                status = 0
+            local[route].append(((time.perf_counter() - scheduled) * 1000, status))
+        with lock:
+            for route, samples in local.items():
+                results[route].extend(samples)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(samples, elapsed):
+    latencies = [latency for latency, _ in samples]
+    statuses = defaultdict(int)
+    for _, status in samples:
+        statuses[status] += 1
+    stats = percentiles(latencies)
+    return {
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 2),
+        'p50_ms': round(stats['p50'], 3), 'p95_ms': round(stats['p95'], 3), 'p99_ms': round(stats['p99'], 3),
+        'mean_ms': round(stats['mean'], 3),
+        # 0: the request itself failed (connection error, timeout)
+        'errors': sum(n for status, n in statuses.items() if status == 0 or status >= 500),
+        'status': {str(status): n for status, n in sorted(statuses.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--capture', default='requests.jsonl')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--bikes', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=0.0, help='requests per second overall (0: as fast as possible)')
+    parser.add_argument('--loops', type=int, default=1, help='times to replay the capture')
+    parser.add_argument('--synthetic', type=int, default=2000, help='requests to generate when the capture is empty')
+    parser.add_argument('--target', choices=('client', 'server'), default='client')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    records = load_capture(args.capture)
+    source = args.capture
+    if not records:
+        print(f'no recorded requests in {args.capture}; generating {args.synthetic} synthetic ones', file=sys.stderr)
+        records = synthetic_capture(args.synthetic, args.users, rng)
+        source = 'synthetic'
+
+    # Never record the replay itself
+    os.environ.pop('RECORD_REQUESTS', None)
+    app = load_app()
+    user_ids, bike_ids = seed(app.DATABASE, users=args.users, bikes=args.bikes)
+    remap = Remapper(user_ids, bike_ids, rng)
+    requests = [remap.request(record) for record in records]
+
+    target = ClientTarget(app) if args.target == 'client' else ServerTarget(app)
+    try:
+        results, elapsed = replay(target, requests, args.concurrency, args.rate, args.loops)
+    finally:
+        target.close()
+
+    report = {
+        'config': {'capture': source, 'requests': len(requests), 'loops': args.loops, 'users': args.users,
+                   'bikes': args.bikes, 'concurrency': args.concurrency, 'rate': args.rate,
+                   'target': args.target, 'seed': args.seed},
+        'elapsed_s': round(elapsed, 3),
+        'routes': {route: summarize(samples, elapsed) for route, samples in sorted(results.items())},
+        'total': summarize([s for samples in results.values() for s in samples], elapsed),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Settle a large backlog of closed rentals into Payments, interrupting the
+run halfway to show it resumes from its checkpoint without double billing.
+The resumed run races /make_payment for unbilled rentals, which must not
+bill any of them twice either.
+
+    python -m benchmarks.bench_settlement [--rentals 1000000] [--batch-size 5000] [--payments 2000]
+"""
+import argparse
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from benchmarks._common import load_app, seed
+from settlement import SettlementEngine
+
+
+def populate(database, user_ids, rentals, rng):
+    conn = sqlite3.connect(database)
+    bikes = [(str(uuid.uuid4()), json.dumps({'name': 'Roadster', 'type': 'city', 'price': rng.choice([10, 20, 35])}))
+             for _ in range(10000)]
+    conn.executemany('INSERT INTO Bicycle (BicycleID, Status, Location, Gear, UserID) VALUES (?, ?, ?, ?, ?)',
+                     ((bike_id, 'Available', 'Depot', gear, user_ids[i % len(user_ids)])
+                      for i, (bike_id, gear) in enumerate(bikes)))
+    origin = datetime.now() - timedelta(days=60)
+    chunk = 100000
+    for start in range(0, rentals, chunk):
+        rows = []
+        for i in range(start, min(rentals, start + chunk)):
+            begin = origin + timedelta(seconds=rng.randrange(50 * 86400))
+            # Mostly short hops, some half-day and multi-day rentals
+            minutes = rng.choice((rng.expovariate(1 / 25), rng.uniform(60, 720), rng.uniform(1440, 4320))
+                                 if rng.random() < 0.1 else (rng.expovariate(1 / 25),))
+            end = begin + timedelta(minutes=minutes)
+            rows.append((str(uuid.uuid4()), user_ids[i % len(user_ids)], bikes[i % len(bikes)][0],
+                         begin.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')))
+        conn.executemany('INSERT INTO Rents (RentalID, UserID, BicycleID, StartTime, EndTime) VALUES (?, ?, ?, ?, ?)',
+                         rows)
+    conn.commit()
+    conn.close()
+
+
+def pay_while_settling(app, rentals, done):
+    # Customers paying for rentals the engine has not reached yet
+    client = app.app.test_client()
+    outcomes = {}
+    for rental_id, user_id in rentals:
+        if done.is_set():
+            break
+        status = client.post('/make_payment', json={'userID': user_id, 'rentalID': rental_id,
+                                                    'cardNumber': '4111111111111111'}).status_code
+        outcomes[status] = outcomes.get(status, 0) + 1
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rentals', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--payments', type=int, default=2000, help='/make_payment calls during the resumed run')
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    app = load_app()
+    user_ids, _ = seed(app.DATABASE, users=1000, bikes=0)
+    started = time.perf_counter()
+    populate(app.DATABASE, user_ids, args.rentals, rng)
+    print(f'seeded {args.rentals} closed rentals in {time.perf_counter() - started:.1f}s')
+
+    engine = SettlementEngine(app.DATABASE, batch_size=args.batch_size)
+    total, seconds = 0, 0.0
+    for label, limit in (('first half (interrupted)', args.rentals // 2), ('resumed', None)):
+        payer = None
+        if limit is None and args.payments:
+            conn = sqlite3.connect(app.DATABASE)
+            unbilled = conn.execute('SELECT RentalID, UserID FROM Rents WHERE RentalID NOT IN '
+                                    '(SELECT RentalID FROM Payments) ORDER BY EndTime, RentalID').fetchall()
+            conn.close()
+            # Spread across the remaining backlog, so most calls race a batch
+            step = max(1, len(unbilled) // args.payments)
+            done, outcomes = threading.Event(), {}
+            payer = threading.Thread(target=lambda: outcomes.update(
+                pay_while_settling(app, unbilled[::step][:args.payments], done)))
+            payer.start()
+        result = engine.run(max_rentals=limit)
+        if payer is not None:
+            done.set()
+            payer.join()
+            print(f'{"":<26} /make_payment during the run: '
+                  + ', '.join(f'{n} x {status}' for status, n in sorted(outcomes.items())))
+        total += result['settled']
+        seconds += result['seconds']
+        print(f'{label:<26} {result["settled"]:>9} rentals in {result["seconds"]:6.1f}s '
+              f'({result["settled"] / max(result["seconds"], 1e-9):,.0f}/s)')
+    print(f'{"total":<26} {total:>9} rentals in {seconds:6.1f}s ({total / seconds:,.0f}/s)')
+
+    conn = sqlite3.connect(app.DATABASE)
+    payments, distinct = conn.execute('SELECT COUNT(*), COUNT(DISTINCT RentalID) FROM Payments').fetchone()
+    carded = conn.execute('SELECT COUNT(*) FROM Payments WHERE CardNumber IS NOT NULL').fetchone()[0]
+    conn.close()
+    print(f'Payments rows {payments}, distinct rentals {distinct}, paid by card {carded}')
+    if payments != args.rentals or distinct != payments:
+        raise SystemExit('FAIL: rentals were skipped or billed twice')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""Keeping N rent.html clients current: polling /bicycles (plain, and
+revalidating with If-None-Match) against following /bicycles/stream.
+Reports read queries, bytes sent and how long each change took to reach
+the clients. Then holds --idle subscribers open on the asyncio
+StreamServer (SSE_PORT) and times one change fanning out to all of them.
+
+    python -m benchmarks.bench_stream [--clients 100] [--fleet 10000] [--duration 10] [--idle 5000]
+"""
+import argparse
+import random
+import resource
+import selectors
+import socket
+import threading
+import time
+
+from benchmarks._common import load_app, percentiles, seed
+from stream_server import StreamServer
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, n=1):
+        with self._lock:
+            self.value += n
+
+
+def run(app, mode, clients, bike_ids, user_id, args):
+    client = app.app.test_client()
+    queries, sent = Counter(), Counter()
+    published = {}          # seq -> publish time
+    delays = []
+    stop = threading.Event()
+
+    # Count statements run on pooled (read) connections
+    app.db_pool.close_all()
+    connect = app.db_pool._connect.__func__
+
+    def traced_connect(pool):
+        conn = connect(pool)
+        conn.set_trace_callback(lambda sql: queries.add())
+        return conn
+    app.db_pool._connect = traced_connect.__get__(app.db_pool)
+
+    def seen(seqs):
+        now = time.perf_counter()
+        delays.extend((now - published[s]) * 1000 for s in seqs if s in published)
+
+    def poller(index, revalidate):
+        rng = random.Random(index)
+        etag, last = None, app.changes.latest
+        time.sleep(rng.random() * args.interval)
+        while not stop.is_set():
+            headers = {'If-None-Match': etag} if revalidate and etag else {}
+            response = client.get(f'/bicycles?limit={args.page}', headers=headers)
+            sent.add(len(response.data))
+            if response.status_code == 200:
+                etag = response.headers['ETag']
+                seq = app.changes.parse_event_id(response.headers['X-Last-Event-ID'])
+                seen(range(last + 1, seq + 1))
+                last = max(last, seq)
+            stop.wait(args.interval)
+
+    def subscriber(index):
+        response = client.get(f'/bicycles?limit={args.page}')
+        sent.add(len(response.data))
+        stream = client.get('/bicycles/stream', buffered=False,
+                            headers={'Last-Event-ID': response.headers['X-Last-Event-ID']})
+        for chunk in stream.response:
+            sent.add(len(chunk))
+            seen(int(line.rpartition(b'-')[2]) for line in chunk.split(b'\n') if line.startswith(b'id: '))
+            if stop.is_set():
+                break
+        stream.close()
+
+    if mode == 'stream':
+        threads = [threading.Thread(target=subscriber, args=(i,)) for i in range(clients)]
+    else:
+        threads = [threading.Thread(target=poller, args=(i, mode == 'poll + ETag')) for i in range(clients)]
+    for t in threads:
+        t.start()
+    time.sleep(0.5)
+    queries.value = sent.value = 0
+
+    # Rentals arrive at a steady rate while clients watch
+    started = time.perf_counter()
+    rents = 0
+    while time.perf_counter() - started < args.duration:
+        # Only this thread publishes, so the rental becomes the next seq
+        published[app.changes.latest + 1] = time.perf_counter()
+        client.post('/rent_bike', json={'userID': user_id, 'bicycleID': bike_ids.pop()})
+        rents += 1
+        time.sleep(1.0 / args.rate)
+    time.sleep(args.interval)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    app.publish_availability('reserved', [])    # wake subscribers so they notice `stop`
+    for t in threads:
+        t.join()
+    app.db_pool._connect = connect.__get__(app.db_pool)
+    return rents, queries.value / elapsed, sent.value / elapsed, percentiles(delays)
+
+
+def idle_subscribers(app, count):
+    server = StreamServer(app.changes, host='127.0.0.1', port=0, heartbeat=app.SSE_HEARTBEAT)
+    port = server.start()
+    threads = threading.active_count()
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    request = (f'GET /bicycles/stream?lastEventId={app.changes.event_id(app.changes.latest)} HTTP/1.1\r\n'
+               f'Host: 127.0.0.1\r\n\r\n').encode('ascii')
+    selector = selectors.DefaultSelector()
+    received = {}
+    for _ in range(count):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(request)
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+        received[sock] = b''
+
+    def read_until(marker, timeout=30.0):
+        # Time at which each subscriber had `marker` in what it received so far
+        arrived = {}
+        deadline = time.perf_counter() + timeout
+        while len(arrived) < count and time.perf_counter() < deadline:
+            for key, _ in selector.select(0.5):
+                received[key.fileobj] += key.fileobj.recv(65536)
+                if marker in received[key.fileobj] and key.fileobj not in arrived:
+                    arrived[key.fileobj] = time.perf_counter()
+        return arrived
+
+    connected = len(read_until(b'retry: 3000'))
+    deadline = time.perf_counter() + 10
+    while app.changes.subscribers < connected and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    published = time.perf_counter()
+    app.publish_availability('reserved', [])
+    delays = percentiles([(t - published) * 1000 for t in read_until(b'event: reserved').values()])
+    print(f'{connected} idle subscribers on the StreamServer: threads {threads} -> {threading.active_count()}, '
+          f'peak RSS +{(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory) / 1024:.1f} MB')
+    print(f'one change reached all of them: delay p50 {delays["p50"] or 0:.1f} ms, p99 {delays["p99"] or 0:.1f} ms')
+    for sock in received:
+        selector.unregister(sock)
+        sock.close()
+    server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--fleet', type=int, default=10000)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--rate', type=float, default=5.0, help='rentals per second')
+    parser.add_argument('--interval', type=float, default=2.0, help='poll interval (seconds)')
+    parser.add_argument('--page', type=int, default=100)
+    parser.add_argument('--idle', type=int, default=5000, help='idle StreamServer subscribers (0 to skip)')
+    args = parser.parse_args()
+
+    app = load_app()
+    user_ids, bike_ids = seed(app.DATABASE, users=10, bikes=args.fleet)
+    random.Random(3).shuffle(bike_ids)
+
+    print(f'{args.clients} clients, {args.rate:g} rentals/s, poll every {args.interval:g}s')
+    print(f'{"mode":<14} {"rentals":>8} {"queries/s":>10} {"KB/s":>9} {"delay p50":>10} {"p99 (ms)":>9}')
+    for mode in ('poll', 'poll + ETag', 'stream'):
+        rents, qps, bps, delay = run(app, mode, args.clients, bike_ids, user_ids[0], args)
+        print(f'{mode:<14} {rents:>8} {qps:>10.1f} {bps / 1024:>9.1f} '
+              f'{delay["p50"] or 0:>10.1f} {delay["p99"] or 0:>9.1f}')
+    print(f'peak subscribers {args.clients}, open now {app.changes.subscribers}')
+    if args.idle:
+        idle_subscribers(app, args.idle)
+
+
+if __name__ == '__main__':
+    main()
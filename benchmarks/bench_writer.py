@@ -0,0 +1,72 @@
+"""Concurrent /give_rent throughput and latency with the old per-request
+commit + sleep-and-retry loop versus the group-commit writer queue.
+
+    python -m benchmarks.bench_writer [--threads 1 4 16 32] [--duration 5]
+"""
+import argparse
+import sqlite3
+import time
+
+from benchmarks._common import load_app, report, run_concurrent, seed
+
+
+def make_retry_write(database):
+    # The write path before the writer queue: a connection per request, one
+    # commit per write and a one second sleep whenever the database is locked.
+    # Takes the same arguments as app.execute_write.
+    def execute_with_retry(job, params=(), on_commit=None, retries=3, delay=1):
+        conn = sqlite3.connect(database, timeout=10.0)
+        try:
+            for attempt in range(retries):
+                try:
+                    result = job(conn) if callable(job) else conn.execute(job, params)
+                    conn.commit()
+                    break
+                except sqlite3.OperationalError as e:
+                    conn.rollback()
+                    if 'database is locked' in str(e) and attempt < retries - 1:
+                        time.sleep(delay)
+                        continue
+                    raise
+        finally:
+            conn.close()
+        if on_commit is not None:
+            on_commit(result)
+        return result
+    return execute_with_retry
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16, 32])
+    parser.add_argument('--duration', type=float, default=5.0)
+    args = parser.parse_args()
+
+    app = load_app()
+    user_ids, _ = seed(app.DATABASE, users=50, bikes=0)
+    client = app.app.test_client()
+    queued = app.execute_write
+
+    def give_rent(i):
+        response = client.post('/give_rent', json={'userID': user_ids[i % len(user_ids)],
+                                                   'location': 'Dock 1',
+                                                   'gear': {'name': 'Roadster', 'type': 'city', 'price': 20}})
+        assert response.status_code == 201, response.get_json()
+
+    for threads in args.threads:
+        for label, write in (('retry-loop', make_retry_write(app.DATABASE)), ('writer-queue', queued)):
+            app.execute_write = write
+            before = app.writer.stats()
+            calls, latencies, elapsed = run_concurrent(give_rent, threads, args.duration)
+            report(f'{label:<13} {threads:>3} threads', calls, latencies, elapsed)
+            if write is queued:
+                after = app.writer.stats()
+                batches = after['batches'] - before['batches']
+                jobs = after['jobs'] - before['jobs']
+                print(f'{"":<18} batches {batches}  mean batch size {jobs / max(batches, 1):.1f}  '
+                      f'max batch size {after["max_batch_size"]}')
+    app.execute_write = queued
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Pragmas applied to every pooled connection. WAL lets readers run alongside the
+# single writer, NORMAL sync is durable across app crashes in WAL mode, and the
+# cache/mmap sizes keep the hot Bicycle/Users pages in memory.
+DEFAULT_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('foreign_keys', 'ON'),
+    ('cache_size', -16000),       # ~16 MB of page cache per connection
+    ('mmap_size', 268435456),     # 256 MB memory-mapped I/O
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 10000),      # same 10 second wait as the old connect timeout
+)
+
+
+def connect(database, pragmas=DEFAULT_PRAGMAS, cached_statements=256):
+    conn = sqlite3.connect(database, timeout=10.0, check_same_thread=False,
+                           cached_statements=cached_statements)
+    conn.row_factory = sqlite3.Row
+    for name, value in pragmas:
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived SQLite connections.
+
+    Connections are created lazily up to ``size`` and handed out through
+    ``connection()``. Borrowers block (up to ``timeout`` seconds) when every
+    connection is in use instead of opening new ones.
+    """
+
+    def __init__(self, database, size=8, timeout=10.0, warm_statements=()):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.warm_statements = list(warm_statements)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = connect(self.database)
+        # Prepare the hot statements once so they land in the connection's
+        # statement cache before the first request needs them.
+        for sql, params in self.warm_statements:
+            try:
+                conn.execute(sql, params).fetchone()
+            except sqlite3.Error:
+                pass
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError('Timed out waiting for a database connection')
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        # Same semantics as ``with sqlite3.connect(...)``: commit on success,
+        # roll back on error, but the connection goes back to the pool.
+        conn = self._acquire()
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            # A connection that can no longer roll back or answer a trivial
+            # query (disk I/O error, corruption, ...) is dropped, not reused.
+            if _healthy(conn):
+                self._release(conn)
+            else:
+                self._discard(conn)
+            raise
+        else:
+            self._release(conn)
+
+    def stats(self):
+        with self._lock:
+            return {'size': self.size, 'created': self._created, 'idle': self._idle.qsize()}
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+def _healthy(conn):
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute('SELECT 1').fetchone()
+        return True
+    except sqlite3.Error:
+        return False
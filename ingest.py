@@ -0,0 +1,159 @@
+import csv
+import json
+import uuid
+
+from spatial import INDEX_BICYCLES_AFTER_SQL, valid_coordinates
+from writer import WriteUnavailable
+
+INSERT_BICYCLE_SQL = '''
+    INSERT INTO Bicycle (BicycleID, Status, Location, Gear, UserID, Latitude, Longitude)
+    VALUES (?, 'Available', ?, ?, ?, ?, ?)
+'''
+
+CSV_GEAR_FIELDS = ('name', 'type', 'price')
+
+
+class IngestError(ValueError):
+    pass
+
+
+def iter_ndjson(lines):
+    """(row number, record or IngestError) for each non-blank line."""
+    for row, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield row, IngestError('Invalid JSON')
+            continue
+        if not isinstance(record, dict):
+            yield row, IngestError('Expected a JSON object')
+            continue
+        yield row, record
+
+
+def iter_csv(lines):
+    """Records from a CSV with a header row. Gear is either a ``gear`` JSON
+    column or separate ``name``/``type``/``price`` columns. Rows are
+    numbered from 1 at the first record, as in ``iter_ndjson``."""
+    reader = csv.DictReader(line.decode('utf-8') if isinstance(line, bytes) else line
+                            for line in lines)
+    for row, record in enumerate(reader, 1):
+        if None in record:
+            yield row, IngestError('Too many columns')
+            continue
+        record = {key: value for key, value in record.items() if value not in (None, '')}
+        try:
+            if 'gear' in record:
+                record['gear'] = json.loads(record['gear'])
+            elif any(field in record for field in CSV_GEAR_FIELDS):
+                record['gear'] = {field: record.pop(field) for field in CSV_GEAR_FIELDS if field in record}
+                if 'price' in record['gear']:
+                    record['gear']['price'] = float(record['gear']['price'])
+            for field in ('latitude', 'longitude'):
+                if field in record:
+                    record[field] = float(record[field])
+        except ValueError:
+            yield row, IngestError('Invalid gear or coordinates')
+            continue
+        yield row, record
+
+
+def bike_params(record, default_owner):
+    """Insert parameters (minus BicycleID) for one record, or IngestError."""
+    owner = record.get('userID') or default_owner
+    location = record.get('location')
+    gear = record.get('gear')
+    if not owner or not location or not gear:
+        raise IngestError('Missing required data')
+    # Checked per row: a value SQLite cannot bind would fail the whole
+    # chunk's insert, and an unhashable userID the owner lookup
+    if not isinstance(owner, str) or not isinstance(location, str) or not isinstance(gear, (dict, str)):
+        raise IngestError('Invalid userID, location or gear')
+    latitude, longitude = record.get('latitude'), record.get('longitude')
+    if (latitude is not None or longitude is not None) and not valid_coordinates(latitude, longitude):
+        raise IngestError('Invalid latitude/longitude')
+    return location, json.dumps(gear), owner, latitude, longitude
+
+
+def insert_chunk(bikes):
+    """Writer job inserting a chunk of validated (BicycleID, params) rows."""
+    def job(conn):
+        # The writer holds the write lock, so every row past the current
+        # highest rowid is one of ours.
+        last_rowid = conn.execute('SELECT COALESCE(MAX(rowid), 0) FROM Bicycle').fetchone()[0]
+        conn.executemany(INSERT_BICYCLE_SQL, ((bike_id,) + params for bike_id, params in bikes))
+        conn.execute(INDEX_BICYCLES_AFTER_SQL, (last_rowid,))
+        return len(bikes)
+    return job
+
+
+def ingest(records, default_owner, existing_owners, submit, wait, on_commit, chunk_size=5000):
+    """Validate and insert streamed records, yielding one result per row.
+
+    Owners are checked once per chunk with ``existing_owners(user_ids)``,
+    which returns the subset that exists; each chunk is inserted as a single
+    writer job from ``submit(job, on_commit=...)``, whose future
+    ``wait(future)`` resolves within the write deadline, and its
+    (BicycleID, params) rows are passed to ``on_commit(bikes)`` by the writer
+    as it commits them. Parsing of the next chunk
+    overlaps with the insert of the previous one. When ``wait`` raises
+    WriteUnavailable, the chunk's rows are reported as errors and the
+    exception propagates; nothing further is submitted.
+    """
+    known_owners = set()
+    in_flight = None
+
+    def flush(chunk):
+        new_owners = {params[2] for _, error, params in chunk if error is None} - known_owners
+        if new_owners:
+            known_owners.update(existing_owners(new_owners))
+        results, bikes = [], []
+        for row, error, params in chunk:
+            if error is None and params[2] not in known_owners:
+                error = IngestError('UserID does not exist in the database!')
+            if error is not None:
+                results.append((row, None, error))
+            else:
+                bike_id = str(uuid.uuid4())
+                bikes.append((bike_id, params))
+                results.append((row, bike_id, None))
+        return results, (submit(insert_chunk(bikes), on_commit=lambda _: on_commit(bikes)) if bikes else None)
+
+    def settle(pending):
+        results, future = pending
+        error = None
+        if future is not None:
+            try:
+                wait(future)
+            except Exception as e:
+                error = e
+        for row, bike_id, row_error in results:
+            if row_error is None and error is None:
+                yield {'row': row, 'bikeID': bike_id}
+            else:
+                yield {'row': row, 'error': str(row_error or error)}
+        if isinstance(error, WriteUnavailable):
+            raise error
+
+    # Each chunk is submitted only once the previous one has settled, so a
+    # stalled writer stops the ingest instead of queueing more behind it.
+    chunk = []
+    for row, record in records:
+        if isinstance(record, IngestError):
+            chunk.append((row, record, None))
+        else:
+            try:
+                chunk.append((row, None, bike_params(record, default_owner)))
+            except IngestError as e:
+                chunk.append((row, e, None))
+        if len(chunk) >= chunk_size:
+            if in_flight is not None:
+                yield from settle(in_flight)
+            in_flight = flush(chunk)
+            chunk = []
+    if in_flight is not None:
+        yield from settle(in_flight)
+    if chunk:
+        yield from settle(flush(chunk))
@@ -0,0 +1,374 @@
+import bisect
+import itertools
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Seconds; fine at the low end, where pooled reads live
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+MAX_STATEMENT_LABEL = 200
+
+# Samples buffered before they are folded into histograms
+MAX_PENDING = 10000
+
+# Sample kinds
+REQUEST, QUERY, STAGE = 'request', 'query', 'stage'
+
+STARTED_KEY = 'metrics.started'
+
+# "IN (?, ?, ?)" lists of any length share one statement label
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+
+log = logging.getLogger(__name__)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield format_number(bound), cumulative
+        yield '+Inf', cumulative + self.counts[-1]
+
+
+class Metrics:
+    """In-process request, query and stage timings rendered for /metrics.
+
+    Recording a sample is one ``deque.append`` (atomic, so lock-free); the
+    samples are folded into histograms on scrape, or once MAX_PENDING
+    have piled up. Queries cost more to observe -- their cursor has to be
+    wrapped -- so only one in every ``1 / query_sample`` connection
+    checkouts is traced.
+
+    Other components (writer, pools, ...) report through collectors:
+    callables returning ``(name, type, help, samples)`` families, with
+    ``samples`` a list of ``(labels, value)`` -- or of ``(labels, Histogram)``
+    for type "histogram" -- read only on scrape.
+
+    With ``slow_query_seconds`` set, a ``slow_query_sample`` fraction of the
+    traced queries slower than that are logged with their EXPLAIN QUERY PLAN.
+    """
+
+    def __init__(self, enabled=True, query_sample=0.1, slow_query_seconds=None, slow_query_sample=1.0):
+        self.enabled = enabled
+        self.query_sample = query_sample
+        self.slow_query_seconds = slow_query_seconds
+        self.slow_query_sample = slow_query_sample
+        self._trace_every = max(1, round(1 / query_sample)) if query_sample > 0 else 0
+        self._checkouts = itertools.count()
+        self._pending = deque()   # (kind, key, seconds, rows) not yet folded
+        self._lock = threading.Lock()
+        self._requests = {}       # (method, route, status) -> Histogram
+        self._queries = {}        # statement -> [Histogram, rows]
+        self._stages = {}         # stage -> Histogram
+        self._slow_queries = 0
+        self._statements = {}     # raw SQL -> statement label
+        self._collectors = []
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def _record(self, sample):
+        self._pending.append(sample)
+        if len(self._pending) > MAX_PENDING:
+            with self._lock:
+                self._fold()
+
+    def observe_request(self, method, route, status, seconds):
+        self._record((REQUEST, (method, route, status), seconds, 0))
+
+    def observe_query(self, sql, seconds, rows):
+        self._record((QUERY, sql, seconds, rows))
+
+    def _fold(self):
+        # Called with the lock held
+        pending = self._pending
+        for _ in range(len(pending)):
+            kind, key, seconds, rows = pending.popleft()
+            if kind is QUERY:
+                statement = self._statements.get(key)
+                if statement is None:
+                    statement = statement_label(key)
+                    if len(self._statements) < 1000:
+                        self._statements[key] = statement
+                entry = self._queries.get(statement)
+                if entry is None:
+                    entry = self._queries[statement] = [Histogram(), 0]
+                entry[0].observe(seconds)
+                entry[1] += rows
+            else:
+                histograms = self._requests if kind is REQUEST else self._stages
+                histogram = histograms.get(key)
+                if histogram is None:
+                    histogram = histograms[key] = Histogram()
+                histogram.observe(seconds)
+
+    def wsgi_middleware(self, wsgi_app):
+        """Wrap a Flask ``wsgi_app`` to stamp each request's start time;
+        ``observe_response``, run as an after_request hook, records it.
+        Stamping here rather than in a before_request hook saves a hook
+        dispatch per request and also counts Flask's own routing."""
+        def stamped_app(environ, start_response):
+            environ[STARTED_KEY] = time.perf_counter()
+            return wsgi_app(environ, start_response)
+        return stamped_app
+
+    def observe_response(self, request, response):
+        # Streamed responses are timed up to their first byte
+        started = request.environ.get(STARTED_KEY)
+        if self.enabled and started is not None:
+            rule = request.url_rule
+            self._record((REQUEST, (request.method, rule.rule if rule is not None else 'unmatched',
+                                    response.status_code), time.perf_counter() - started, 0))
+
+    def is_slow(self, seconds):
+        return (self.slow_query_seconds is not None and seconds >= self.slow_query_seconds
+                and random.random() < self.slow_query_sample)
+
+    def log_slow_query(self, conn, sql, params, seconds, rows):
+        with self._lock:
+            self._slow_queries += 1
+        try:
+            plan = '\n'.join(f'  {row[-1]}' for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params))
+        except Exception as e:
+            plan = f'  (no plan: {e})'
+        log.warning('slow query %.1f ms, %d rows: %s\n%s', seconds * 1000, rows, ' '.join(sql.split()), plan)
+
+    @contextmanager
+    def stage(self, name):
+        # Time one phase of a request (bcrypt, JSON encoding, ...)
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record((STAGE, name, time.perf_counter() - started, 0))
+
+    def connection(self, conn):
+        # Every ``_trace_every``-th checkout is traced; count() is atomic
+        if not self.enabled or not self._trace_every or next(self._checkouts) % self._trace_every:
+            return conn
+        return TracedConnection(conn, self)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            self._fold()
+            histogram_family(lines, 'http_request_duration_seconds', 'Request latency by route.',
+                             [({'method': m, 'route': r, 'status': s}, h)
+                              for (m, r, s), h in sorted(self._requests.items())])
+            histogram_family(lines, 'db_query_duration_seconds',
+                             'Time spent executing and fetching sampled pooled-connection queries.',
+                             [({'statement': s}, e[0]) for s, e in sorted(self._queries.items())])
+            counter_family(lines, 'db_query_rows_total', 'Rows fetched by sampled pooled-connection queries.',
+                           [({'statement': s}, e[1]) for s, e in sorted(self._queries.items())])
+            gauge_family(lines, 'db_query_sample_ratio', 'Fraction of connection checkouts whose queries are traced.',
+                         [({}, 1 / self._trace_every if self._trace_every else 0.0)])
+            counter_family(lines, 'db_slow_queries_total', 'Slow queries sampled for EXPLAIN QUERY PLAN.',
+                           [({}, self._slow_queries)])
+            histogram_family(lines, 'app_stage_duration_seconds', 'Time spent in instrumented request stages.',
+                             [({'stage': s}, h) for s, h in sorted(self._stages.items())])
+        for collector in self._collectors:
+            for name, kind, help, samples in collector():
+                if kind == 'histogram':
+                    histogram_family(lines, name, help, samples)
+                    continue
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{format_labels(labels)} {format_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class TracedConnection:
+    """sqlite3.Connection stand-in that times its statements.
+
+    Only ``execute``/``executemany``/``cursor`` are intercepted; everything
+    else goes to the real connection. Statements that return no rows are
+    recorded straight away; for the rest a TracedCursor adds up fetch time.
+    """
+
+    def __init__(self, conn, metrics):
+        self._conn = conn
+        self._metrics = metrics
+        self._open = None
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self):
+        return _CursorFactory(self)
+
+    def execute(self, sql, params=()):
+        if self._open is not None:
+            self._open.finish()
+        started = time.perf_counter()
+        cursor = self._conn.execute(sql, params)
+        seconds = time.perf_counter() - started
+        if cursor.description is None:
+            self.record(sql, params, seconds, 0)
+            return cursor
+        self._open = TracedCursor(self, cursor, sql, params, seconds)
+        return self._open
+
+    def executemany(self, sql, seq_of_params):
+        if self._open is not None:
+            self._open.finish()
+        started = time.perf_counter()
+        cursor = self._conn.executemany(sql, seq_of_params)
+        self.record(sql, None, time.perf_counter() - started, 0)
+        return cursor
+
+    def executescript(self, script):
+        return self._conn.executescript(script)
+
+    def record(self, sql, params, seconds, rows):
+        metrics = self._metrics
+        metrics.observe_query(sql, seconds, rows)
+        if metrics.slow_query_seconds is not None and params is not None and metrics.is_slow(seconds):
+            metrics.log_slow_query(self._conn, sql, params, seconds, rows)
+
+    def finish(self):
+        # Record a query whose rows were never fully read
+        if self._open is not None:
+            self._open.finish()
+
+
+class _CursorFactory:
+    # What ``TracedConnection.cursor()`` returns: each execute goes through
+    # the connection, so it is timed like ``conn.execute``.
+    def __init__(self, traced):
+        self._traced = traced
+
+    def execute(self, sql, params=()):
+        return self._traced.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._traced.executemany(sql, seq_of_params)
+
+
+class TracedCursor:
+    """Adds up fetch time and rows for one statement and records them once
+    the rows are exhausted, another statement starts on the connection, or
+    the connection goes back to the pool."""
+
+    __slots__ = ('_traced', '_cursor', '_sql', '_params', '_seconds', '_rows')
+
+    def __init__(self, traced, cursor, sql, params, seconds):
+        self._traced = traced
+        self._cursor = cursor
+        self._sql = sql
+        self._params = params
+        self._seconds = seconds
+        self._rows = 0
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def finish(self):
+        sql = self._sql
+        if sql is None:
+            return
+        self._sql = None
+        traced = self._traced
+        if traced._open is self:
+            traced._open = None
+        if traced._metrics.slow_query_seconds is None:
+            traced._metrics.observe_query(sql, self._seconds, self._rows)
+        else:
+            traced.record(sql, self._params, self._seconds, self._rows)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._seconds += time.perf_counter() - started
+        if row is None:
+            self.finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self._cursor.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = self._cursor.fetchmany(size)
+        self._seconds += time.perf_counter() - started
+        self._rows += len(rows)
+        # A short batch means the rows ran out
+        if len(rows) < size:
+            self.finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._seconds += time.perf_counter() - started
+        self._rows += len(rows)
+        self.finish()
+        return rows
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(1000)
+            yield from rows
+            if len(rows) < 1000:
+                return
+
+
+def statement_label(sql):
+    statement = _PLACEHOLDER_LIST.sub('?, ...', ' '.join(sql.split()))
+    return statement if len(statement) <= MAX_STATEMENT_LABEL else statement[:MAX_STATEMENT_LABEL - 3] + '...'
+
+
+def format_number(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+def counter_family(lines, name, help, samples):
+    lines.append(f'# HELP {name} {help}')
+    lines.append(f'# TYPE {name} counter')
+    for labels, value in samples:
+        lines.append(f'{name}{format_labels(labels)} {format_number(value)}')
+
+
+def gauge_family(lines, name, help, samples):
+    lines.append(f'# HELP {name} {help}')
+    lines.append(f'# TYPE {name} gauge')
+    for labels, value in samples:
+        lines.append(f'{name}{format_labels(labels)} {format_number(value)}')
+
+
+def histogram_family(lines, name, help, histograms):
+    lines.append(f'# HELP {name} {help}')
+    lines.append(f'# TYPE {name} histogram')
+    for labels, histogram in histograms:
+        count = 0
+        for bound, count in histogram.samples():
+            lines.append(f'{name}_bucket{format_labels(dict(labels, le=bound))} {count}')
+        lines.append(f'{name}_sum{format_labels(labels)} {format_number(histogram.sum)}')
+        lines.append(f'{name}_count{format_labels(labels)} {count}')
@@ -0,0 +1,86 @@
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+# (method, route rule) pairs worth capturing for replay
+RECORDED_ROUTES = {
+    ('POST', '/register'),
+    ('POST', '/login_user'),
+    ('GET', '/bicycles'),
+    ('POST', '/give_rent'),
+    ('POST', '/rent_bike'),
+}
+
+REDACTED = '<redacted>'
+
+# Body fields never written out as-is
+SECRET_FIELDS = {'password'}
+HASHED_FIELDS = {'emailID'}
+DROPPED_FIELDS = {'name', 'phoneNo', 'DOB'}
+
+
+def pseudonym(value, key):
+    """Keyed stand-in for an identifier, so a replay can still tell that two
+    requests came from the same email. Without ``key`` it cannot be checked
+    against a list of guessed emails, as a plain hash could."""
+    return hmac.new(key, str(value).strip().lower().encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+
+
+def sanitize(body, key):
+    if not isinstance(body, dict):
+        return body
+    clean = {}
+    for name, value in body.items():
+        if name in DROPPED_FIELDS:
+            continue
+        if name in SECRET_FIELDS:
+            clean[name] = REDACTED
+        elif name in HASHED_FIELDS:
+            clean[name] = pseudonym(value, key)
+        else:
+            clean[name] = value
+    return clean
+
+
+class RequestRecorder:
+    """Appends one JSON line per recorded request for benchmarks/bench_replay.
+
+    Each line holds the wall-clock time, method, path, query string,
+    sanitized JSON body, whether a session token was sent, the response
+    status and the server-side latency. Passwords are redacted, emails
+    replaced by a pseudonym and other personal fields dropped. The
+    pseudonym key is random per recorder and never written out, so
+    pseudonyms only match within one recording run.
+    """
+
+    def __init__(self, path, routes=RECORDED_ROUTES):
+        self.path = path
+        self.routes = routes
+        self._key = os.urandom(32)
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+        self._lock = threading.Lock()
+
+    def record(self, request, response, seconds):
+        rule = request.url_rule
+        if rule is None or (request.method, rule.rule) not in self.routes:
+            return
+        line = json.dumps({
+            'ts': round(time.time(), 6),
+            'method': request.method,
+            'path': request.path,
+            'query': request.query_string.decode('latin-1'),
+            'body': sanitize(request.get_json(silent=True), self._key) if request.is_json else None,
+            'auth': request.headers.get('Authorization', '').startswith('Bearer '),
+            'status': response.status_code,
+            'ms': round(seconds * 1000, 3),
+        })
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
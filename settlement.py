@@ -0,0 +1,182 @@
+import argparse
+import math
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from db_pool import connect
+
+DEFAULT_RATE = 20.0    # Rs/hour when a bike's Gear has no usable price
+
+# Fare rules, all in multiples of the bike's hourly rate:
+#   - a flat unlock fee per rental,
+#   - per-minute tiers: full rate for the first hour, then cheaper,
+#   - any 24 hours cost at most a day pass, so long rentals are capped.
+DEFAULT_TARIFF = {
+    'unlock_fee': 10.0,
+    'tiers': ((60, 1.0), (240, 0.8), (None, 0.5)),   # (up to minute, rate multiplier)
+    'day_pass_hours': 8.0,
+}
+
+CREATE_TABLES_SQL = '''
+    CREATE TABLE IF NOT EXISTS SettlementCheckpoint (
+        Name VARCHAR(50) PRIMARY KEY,
+        EndTime DATETIME NOT NULL,
+        RentalID VARCHAR(50) NOT NULL,
+        Settled INTEGER NOT NULL DEFAULT 0,
+        UpdatedAt DATETIME NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_rents_end ON Rents (EndTime, RentalID);
+    CREATE INDEX IF NOT EXISTS idx_payments_rental ON Payments (RentalID);
+'''
+
+# Keyset cursor over closed, unbilled rentals in (EndTime, RentalID) order.
+# Each batch is read inside its own short write transaction: the scan never
+# pins an old snapshot (which would stop WAL checkpoints for the whole run),
+# and no /make_payment can bill a rental between the read and the insert.
+UNBILLED_RENTALS_SQL = '''
+    SELECT R.RentalID, R.UserID, R.EndTime,
+           (julianday(R.EndTime) - julianday(R.StartTime)) * 1440.0 AS Minutes,
+           CASE WHEN json_valid(B.Gear) THEN json_extract(B.Gear, '$.price') END AS Rate
+    FROM Rents R
+    LEFT JOIN Bicycle B ON B.BicycleID = R.BicycleID
+    WHERE R.EndTime IS NOT NULL AND R.EndTime <= ?
+      AND (R.EndTime, R.RentalID) > (?, ?)
+      AND NOT EXISTS (SELECT 1 FROM Payments P WHERE P.RentalID = R.RentalID)
+    ORDER BY R.EndTime, R.RentalID
+    LIMIT ?
+'''
+
+INSERT_PAYMENT_SQL = '''
+    INSERT INTO Payments (PaymentID, UserID, RentalID, Amount, PaymentDate, CardNumber)
+    VALUES (?, ?, ?, ?, ?, NULL)
+'''
+
+SAVE_CHECKPOINT_SQL = '''
+    INSERT INTO SettlementCheckpoint (Name, EndTime, RentalID, Settled, UpdatedAt)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (Name) DO UPDATE SET
+        EndTime = excluded.EndTime, RentalID = excluded.RentalID,
+        Settled = Settled + excluded.Settled, UpdatedAt = excluded.UpdatedAt
+'''
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def create_tables(conn):
+    conn.executescript(CREATE_TABLES_SQL)
+
+
+def fare(minutes, rate, tariff=DEFAULT_TARIFF):
+    return fares([minutes], [rate], tariff)[0]
+
+
+def fares(minutes, rates, tariff=DEFAULT_TARIFF):
+    """Fares for a batch of rentals, computed column by column.
+
+    ``minutes`` and ``rates`` are parallel sequences; rates may contain
+    ``None`` or junk, which fall back to DEFAULT_RATE.
+    """
+    rates = [r if isinstance(r, (int, float)) and r >= 0 else DEFAULT_RATE for r in rates]
+    billed = [max(1, math.ceil(m - 1e-9)) if m and m > 0 else 1 for m in minutes]
+    days = [b // 1440 for b in billed]
+    rest = [b % 1440 for b in billed]
+
+    # Per-minute charge of the partial day, one tier at a time
+    tiered = [0.0] * len(billed)
+    floor = 0
+    for upto, multiplier in tariff['tiers']:
+        for i, m in enumerate(rest):
+            if m > floor:
+                span = (m if upto is None else min(m, upto)) - floor
+                tiered[i] += span * multiplier
+        if upto is None:
+            break
+        floor = upto
+
+    day_pass_minutes = tariff['day_pass_hours'] * 60
+    unlock = tariff['unlock_fee']
+    return [round(unlock + (d * day_pass_minutes + min(t, day_pass_minutes)) * r / 60.0, 2)
+            for d, t, r in zip(days, tiered, rates)]
+
+
+class SettlementEngine:
+    """Turns closed rentals into Payments rows, resumably.
+
+    Rentals are read in keyset batches, priced with ``fares`` and written
+    with ``executemany`` -- one short write transaction per batch that reads
+    it, inserts its Payments and advances the checkpoint, so a crash or
+    restart resumes exactly after the last committed batch. Only rentals that ended at least ``delay`` seconds
+    ago are settled, leaving room for in-flight returns that share an
+    EndTime with the checkpoint.
+    """
+
+    def __init__(self, database, name='default', batch_size=5000, delay=60, tariff=DEFAULT_TARIFF):
+        self.database = database
+        self.name = name
+        self.batch_size = batch_size
+        self.delay = delay
+        self.tariff = tariff
+
+    def run(self, max_rentals=None, now=None):
+        conn = connect(self.database)
+        conn.isolation_level = None
+        try:
+            create_tables(conn)
+            cutoff = ((now or datetime.now()) - timedelta(seconds=self.delay)).strftime(TIME_FORMAT)
+            row = conn.execute('SELECT EndTime, RentalID FROM SettlementCheckpoint WHERE Name = ?',
+                               (self.name,)).fetchone()
+            position = (row['EndTime'], row['RentalID']) if row else ('', '')
+
+            settled, amount, batches = 0, 0.0, 0
+            started = time.perf_counter()
+            while max_rentals is None or settled < max_rentals:
+                limit = self.batch_size if max_rentals is None else min(self.batch_size, max_rentals - settled)
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    rentals = conn.execute(UNBILLED_RENTALS_SQL, (cutoff,) + position + (limit,)).fetchall()
+                    if not rentals:
+                        conn.execute('COMMIT')
+                        break
+                    charges = fares([r['Minutes'] for r in rentals], [r['Rate'] for r in rentals], self.tariff)
+                    paid_at = datetime.now().strftime(TIME_FORMAT)
+                    last = rentals[-1]
+                    conn.executemany(INSERT_PAYMENT_SQL, (
+                        (str(uuid.uuid4()), r['UserID'], r['RentalID'], charge, paid_at)
+                        for r, charge in zip(rentals, charges)))
+                    conn.execute(SAVE_CHECKPOINT_SQL, (self.name, last['EndTime'], last['RentalID'],
+                                                       len(rentals), paid_at))
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+                position = (last['EndTime'], last['RentalID'])
+                settled += len(rentals)
+                amount += sum(charges)
+                batches += 1
+
+            return {'settled': settled, 'amount': round(amount, 2), 'batches': batches,
+                    'seconds': time.perf_counter() - started, 'checkpoint': position}
+        finally:
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Settle closed rentals into Payments.')
+    parser.add_argument('--db', default=os.environ.get('BICYCLE_DB', 'bicycleRental.db'))
+    parser.add_argument('--name', default='default', help='checkpoint name')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--delay', type=int, default=60, help='only settle rentals older than this (seconds)')
+    parser.add_argument('--max-rentals', type=int)
+    args = parser.parse_args()
+
+    engine = SettlementEngine(args.db, name=args.name, batch_size=args.batch_size, delay=args.delay)
+    result = engine.run(max_rentals=args.max_rentals)
+    rate = result['settled'] / result['seconds'] if result['seconds'] else 0.0
+    print(f"settled {result['settled']} rentals (Rs {result['amount']:.2f}) in {result['batches']} batches, "
+          f"{result['seconds']:.1f}s, {rate:.0f} rentals/s")
+
+
+if __name__ == '__main__':
+    main()
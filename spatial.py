@@ -0,0 +1,134 @@
+import heapq
+import math
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE_LAT = 111320.0
+
+# R*Tree over the coordinates of *available* bikes, keyed by Bicycle.rowid.
+# Bikes leave the index when rented and come back when returned, so nearby
+# searches never have to look at rented bikes. Bicycle has no INTEGER PRIMARY
+# KEY, so a VACUUM may renumber rowids; run REBUILD_INDEX_SQL after one.
+CREATE_INDEX_SQL = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS BicycleLocation USING rtree(
+        id, minLat, maxLat, minLon, maxLon
+    )
+'''
+
+INDEX_BICYCLE_SQL = '''
+    INSERT OR REPLACE INTO BicycleLocation (id, minLat, maxLat, minLon, maxLon)
+    SELECT rowid, Latitude, Latitude, Longitude, Longitude
+    FROM Bicycle
+    WHERE BicycleID = ? AND Latitude IS NOT NULL AND Longitude IS NOT NULL
+'''
+
+# Index every bike inserted after the given rowid. One set-based statement
+# instead of a row-at-a-time INDEX_BICYCLE_SQL: R*Tree writes get steadily
+# slower as statements pile up inside one savepoint.
+INDEX_BICYCLES_AFTER_SQL = '''
+    INSERT INTO BicycleLocation (id, minLat, maxLat, minLon, maxLon)
+    SELECT rowid, Latitude, Latitude, Longitude, Longitude
+    FROM Bicycle
+    WHERE rowid > ? AND Latitude IS NOT NULL AND Longitude IS NOT NULL
+'''
+
+REBUILD_INDEX_SQL = '''
+    INSERT OR REPLACE INTO BicycleLocation (id, minLat, maxLat, minLon, maxLon)
+    SELECT rowid, Latitude, Latitude, Longitude, Longitude
+    FROM Bicycle
+    WHERE Status = 'Available' AND Latitude IS NOT NULL AND Longitude IS NOT NULL
+'''
+
+UNINDEX_BICYCLE_SQL = '''
+    DELETE FROM BicycleLocation WHERE id = (SELECT rowid FROM Bicycle WHERE BicycleID = ?)
+'''
+
+CANDIDATES_SQL = '''
+    SELECT id, minLat, minLon FROM BicycleLocation
+    WHERE maxLat >= ? AND minLat <= ? AND maxLon >= ? AND minLon <= ?
+'''
+
+DETAILS_SQL = '''
+    SELECT B.rowid AS id, B.BicycleID, B.Status, B.Location, B.Gear, B.Latitude, B.Longitude,
+           U.Name AS OwnerName
+    FROM Bicycle B
+    LEFT JOIN Users U ON B.UserID = U.UserID
+    WHERE B.rowid IN ({placeholders})
+'''
+
+# First search ring; doubled until enough bikes are found or the radius is hit
+INITIAL_SEARCH_M = 200.0
+RERANK_MARGIN = 8
+
+
+def valid_coordinates(lat, lon):
+    for value in (lat, lon):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or math.isnan(value):
+            return False
+    return -90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lon, radius_m):
+    dlat = radius_m / METERS_PER_DEGREE_LAT
+    cos_lat = math.cos(math.radians(lat))
+    min_lat, max_lat = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    if cos_lat < 1e-6 or max_lat >= 90.0 or min_lat <= -90.0:
+        return min_lat, max_lat, -180.0, 180.0
+    dlon = radius_m / (METERS_PER_DEGREE_LAT * cos_lat)
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180.0 or max_lon > 180.0:
+        # Crossing the antimeridian: fall back to the full longitude band.
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def nearest_bicycles(conn, lat, lon, radius_m, limit):
+    """The ``limit`` available bikes closest to (lat, lon) within ``radius_m``.
+
+    The R*Tree gives a bounding-box prefilter; candidates are then ranked by
+    exact great-circle distance. The search starts with a small box and
+    doubles it, so dense areas only ever touch a few hundred index entries.
+    """
+    search = min(INITIAL_SEARCH_M, radius_m)
+    while True:
+        candidates = []
+        for bike_id, bike_lat, bike_lon in conn.execute(CANDIDATES_SQL, bounding_box(lat, lon, search)):
+            distance = haversine_m(lat, lon, bike_lat, bike_lon)
+            if distance <= search:
+                candidates.append((distance, bike_id))
+        # Everything within `search` is in the box, so once the box holds
+        # `limit` bikes inside the ring those are the true nearest ones.
+        if len(candidates) >= limit or search >= radius_m:
+            break
+        search = min(search * 2, radius_m)
+
+    # The R*Tree stores 32-bit floats, good to about a metre. Take a few
+    # spare candidates and re-rank them on the exact stored coordinates.
+    closest = heapq.nsmallest(limit + RERANK_MARGIN, candidates)
+    if not closest:
+        return []
+    rows = conn.execute(DETAILS_SQL.format(placeholders=','.join('?' * len(closest))),
+                        [bike_id for _, bike_id in closest]).fetchall()
+    ranked = []
+    for row in rows:
+        # Checked here rather than in SQL: a Status predicate tempts the
+        # planner into walking idx_bicycle_status instead of the rowid lookups.
+        if row['Status'] != 'Available':
+            continue
+        distance = haversine_m(lat, lon, row['Latitude'], row['Longitude'])
+        if distance <= radius_m:
+            ranked.append((distance, row['BicycleID'], row))
+    results = []
+    for distance, _, row in heapq.nsmallest(limit, ranked, key=lambda item: item[:2]):
+        bike = dict(row)
+        del bike['id']
+        bike['Distance'] = round(distance, 1)
+        results.append(bike)
+    return results
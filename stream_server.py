@@ -0,0 +1,178 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from urllib.parse import parse_qs, urlsplit
+
+STREAM_PATH = '/bicycles/stream'
+MAX_REQUEST_BYTES = 8192
+
+STREAM_HEAD = (
+    b'HTTP/1.1 200 OK\r\n'
+    b'Content-Type: text/event-stream; charset=utf-8\r\n'
+    b'Cache-Control: no-cache\r\n'
+    b'X-Accel-Buffering: no\r\n'
+    b'Access-Control-Allow-Origin: *\r\n'
+    b'Connection: close\r\n'
+    b'\r\n'
+    b'retry: 3000\n\n'
+)
+
+# EventSource sends Last-Event-ID on reconnect, which is not a CORS-safelisted header
+PREFLIGHT = (
+    b'HTTP/1.1 204 No Content\r\n'
+    b'Access-Control-Allow-Origin: *\r\n'
+    b'Access-Control-Allow-Methods: GET\r\n'
+    b'Access-Control-Allow-Headers: Last-Event-ID, Cache-Control\r\n'
+    b'Access-Control-Max-Age: 86400\r\n'
+    b'Content-Length: 0\r\n'
+    b'Connection: close\r\n'
+    b'\r\n'
+)
+
+NOT_FOUND = b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+
+class StreamServer:
+    """Serves /bicycles/stream from a single asyncio thread.
+
+    Under the WSGI server every open stream holds a request thread. Here a
+    subscriber is a coroutine parked on one shared asyncio.Event that is
+    swapped out and set after every ChangeLog publish, so thousands of idle
+    subscribers cost a socket and a few KB each. Events, ids, heartbeats
+    and resets are the same as the Flask route's. Started on first use by
+    ``start()``, which returns the bound port.
+    """
+
+    def __init__(self, changes, host='127.0.0.1', port=0, heartbeat=15.0,
+                 send_timeout=30.0, request_timeout=10.0, backlog=1024):
+        self.changes = changes
+        self.host = host
+        self.port = port
+        self.heartbeat = heartbeat
+        self.send_timeout = send_timeout
+        self.request_timeout = request_timeout
+        self.backlog = backlog
+        self._loop = None
+        self._thread = None
+        self._started = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._started = Future()
+                self._thread = threading.Thread(target=self._run, name='sse-server', daemon=True)
+                self._thread.start()
+        return self._started.result()
+
+    def close(self, timeout=5.0):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._stopping.set)
+            thread.join(timeout)
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._serve(loop))
+        finally:
+            loop.close()
+
+    async def _serve(self, loop):
+        self._changed = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._streams = {}      # handler task -> its StreamWriter
+        try:
+            server = await asyncio.start_server(self._handle, self.host, self.port,
+                                                backlog=self.backlog, limit=MAX_REQUEST_BYTES)
+        except BaseException as e:
+            self._started.set_exception(e)
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        self._loop = loop
+        self.changes.add_listener(self._notify)
+        self._started.set_result(self.port)
+
+        await self._stopping.wait()
+        self.changes.remove_listener(self._notify)
+        server.close()
+        # Wake idle streams so they see _stopping, and fail pending sends
+        self._wake()
+        for writer in self._streams.values():
+            writer.transport.abort()
+        await asyncio.gather(*self._streams, return_exceptions=True)
+        await server.wait_closed()
+
+    def _notify(self):
+        # Called on the publishing (writer) thread
+        self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._streams[task] = writer
+        try:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.request_timeout)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                return
+            method, target, headers = parse_request(head)
+            url = urlsplit(target)
+            if method == 'OPTIONS' and url.path == STREAM_PATH:
+                writer.write(PREFLIGHT)
+            elif method == 'GET' and url.path == STREAM_PATH:
+                last_event_id = headers.get('last-event-id') or parse_qs(url.query).get('lastEventId', [None])[0]
+                await self._stream(reader, writer, self.changes.parse_event_id(last_event_id))
+            else:
+                writer.write(NOT_FOUND)
+            await asyncio.wait_for(writer.drain(), self.send_timeout)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            del self._streams[task]
+            writer.close()
+
+    async def _stream(self, reader, writer, seq):
+        writer.write(STREAM_HEAD)
+        # EventSource sends nothing after its request: anything readable,
+        # usually EOF, means the client has gone.
+        gone = asyncio.ensure_future(reader.read(MAX_REQUEST_BYTES))
+        try:
+            with self.changes.subscription():
+                while not self._stopping.is_set():
+                    # Taken before reading, so a publish in between still wakes us
+                    changed = self._changed
+                    seq, text = self.changes.read(seq)
+                    if text:
+                        writer.write(text.encode('utf-8'))
+                    else:
+                        woken = asyncio.ensure_future(changed.wait())
+                        done, _ = await asyncio.wait((woken, gone), timeout=self.heartbeat,
+                                                     return_when=asyncio.FIRST_COMPLETED)
+                        if woken in done:
+                            continue
+                        woken.cancel()
+                        if gone in done:
+                            return
+                        writer.write(b': keep-alive\n\n')
+                    # A client that stops reading is dropped rather than buffered for
+                    await asyncio.wait_for(writer.drain(), self.send_timeout)
+        finally:
+            gone.cancel()
+
+
+def parse_request(head):
+    """(method, target, lower-cased headers) of a raw HTTP request head."""
+    lines = head.decode('latin-1').split('\r\n')
+    method, _, rest = lines[0].partition(' ')
+    target = rest.partition(' ')[0]
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return method, target, headers
@@ -0,0 +1,202 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from db_pool import connect
+
+log = logging.getLogger(__name__)
+
+
+class WriteUnavailable(Exception):
+    """The write queue is full or a write did not finish within its deadline."""
+
+
+_STOP = object()
+
+
+class WriteQueue:
+    """Single writer thread that owns the write connection.
+
+    Request handlers submit jobs -- an SQL string with parameters, or a
+    callable taking the connection -- and get a Future back. The writer drains
+    whatever is queued (up to ``max_batch`` jobs) into one transaction and
+    commits once, so concurrent writes share a single fsync instead of
+    fighting over the database lock. Each job runs inside its own savepoint,
+    so one failing job does not take the rest of its batch down with it.
+
+    A job's ``on_commit(result)`` runs on the writer thread as soon as its
+    batch commits, before the job's future resolves, so callbacks see
+    writes in exactly the order they were committed.
+    """
+
+    def __init__(self, database, max_batch=256, max_pending=10000,
+                 submit_timeout=1.0, lock_retries=5, lock_backoff=0.05, busy_timeout=0.1):
+        self.database = database
+        self.max_batch = max_batch
+        self.submit_timeout = submit_timeout
+        self.busy_timeout = busy_timeout
+        self.lock_retries = lock_retries
+        self.lock_backoff = lock_backoff
+        self._jobs = queue.Queue(maxsize=max_pending)
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._jobs_done = 0
+        self._failed_jobs = 0
+        self._max_batch_seen = 0
+        self._batch_histogram = {}
+        self._lock_retries = 0
+        self._lock_sleep = 0.0
+        self._batch_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, job, params=(), on_commit=None):
+        future = Future()
+        try:
+            self._jobs.put((future, job, params, on_commit), timeout=self.submit_timeout)
+        except queue.Full:
+            raise WriteUnavailable('Write queue is full')
+        return future
+
+    def execute(self, job, params=(), timeout=None, on_commit=None):
+        return self.wait(self.submit(job, params, on_commit), timeout)
+
+    def wait(self, future, timeout=None):
+        """Result of a submitted job, waiting at most ``timeout`` seconds for
+        it to start and as long again for its batch to commit."""
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            if future.cancel():
+                raise WriteUnavailable('Timed out waiting for the database writer')
+        # Already part of the batch being committed
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            raise WriteUnavailable('Timed out waiting for the database writer to commit, '
+                                   'the write may still be applied') from None
+
+    def close(self, timeout=5.0):
+        if self._thread.is_alive():
+            self._jobs.put(_STOP)
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queue_depth': self._jobs.qsize(),
+                'batches': self._batches,
+                'jobs': self._jobs_done,
+                'failed_jobs': self._failed_jobs,
+                'max_batch_size': self._max_batch_seen,
+                'mean_batch_size': self._jobs_done / self._batches if self._batches else 0.0,
+                'batch_size_histogram': dict(sorted(self._batch_histogram.items())),
+                'lock_retries': self._lock_retries,
+                'lock_sleep_seconds': self._lock_sleep,
+                'batch_seconds': self._batch_seconds,
+            }
+
+    def _run(self):
+        conn = connect(self.database)
+        # Transactions are managed explicitly below.
+        conn.isolation_level = None
+        # Give up on a held lock quickly and let _commit_batch's millisecond
+        # backoff retry, instead of blocking inside SQLite for seconds.
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}')
+        try:
+            while True:
+                item = self._jobs.get()
+                if item is _STOP:
+                    return
+                batch = [item]
+                stop = False
+                while len(batch) < self.max_batch:
+                    try:
+                        item = self._jobs.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stop = True
+                        break
+                    batch.append(item)
+                batch = [job for job in batch if job[0].set_running_or_notify_cancel()]
+                if batch:
+                    self._commit_batch(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn, batch):
+        started = time.perf_counter()
+        for attempt in range(self.lock_retries):
+            try:
+                outcomes = self._apply(conn, batch)
+                break
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                if 'database is locked' in str(e) and attempt < self.lock_retries - 1:
+                    delay = self.lock_backoff * (2 ** attempt)
+                    with self._stats_lock:
+                        self._lock_retries += 1
+                        self._lock_sleep += delay
+                    time.sleep(delay)
+                    continue
+                outcomes = [(future, None, e) for future, _, _, _ in batch]
+                break
+            except BaseException as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                outcomes = [(future, None, e) for future, _, _, _ in batch]
+                break
+
+        for (_, _, _, on_commit), (_, result, error) in zip(batch, outcomes):
+            if on_commit is not None and error is None:
+                try:
+                    on_commit(result)
+                except Exception:
+                    log.exception('on_commit callback failed')
+
+        failed = 0
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                failed += 1
+                future.set_exception(error)
+
+        size = len(batch)
+        bucket = 1 << (size - 1).bit_length()
+        with self._stats_lock:
+            self._batches += 1
+            self._jobs_done += size
+            self._failed_jobs += failed
+            self._max_batch_seen = max(self._max_batch_seen, size)
+            self._batch_histogram[bucket] = self._batch_histogram.get(bucket, 0) + 1
+            self._batch_seconds += time.perf_counter() - started
+
+    def _apply(self, conn, batch):
+        conn.execute('BEGIN IMMEDIATE')
+        outcomes = []
+        for future, job, params, _ in batch:
+            conn.execute('SAVEPOINT job')
+            try:
+                if callable(job):
+                    result = job(conn)
+                else:
+                    result = conn.execute(job, params).rowcount
+            except Exception as e:
+                if isinstance(e, sqlite3.OperationalError) and 'database is locked' in str(e):
+                    raise
+                conn.execute('ROLLBACK TO job')
+                conn.execute('RELEASE job')
+                outcomes.append((future, None, e))
+            else:
+                conn.execute('RELEASE job')
+                outcomes.append((future, result, None))
+        conn.execute('COMMIT')
+        return outcomes